@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+'''
+Implements packed bitsets on top of numpy byte arrays.
+
+A bitset over n items is stored as an array of (n + 7) / 8 bytes, in the
+layout of np.packbits. A matrix of bitsets is a 2D array with one bitset
+per row, so word-wide operations such as AND and ANDNOT apply to whole
+rows (or all rows) at once.
+
+Copyright (C) 2012  Steven Laan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see http://www.gnu.org/licenses/
+'''
+
+import numpy as np
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in xrange(256)], dtype=np.uint8)
+
+
+def num_bytes(n):
+    '''
+    Returns the number of bytes needed for a bitset over n items.
+    '''
+
+    return (n + 7) // 8
+
+
+def empty(n, rows=None):
+    '''
+    Creates an empty bitset, or a matrix of empty bitsets.
+
+    Parameters
+    ----------
+    n : int
+        The number of items in the universe.
+    rows : int
+        The number of bitsets in the matrix. Default None, which returns
+        a single bitset.
+    '''
+
+    if rows is None:
+        return np.zeros(num_bytes(n), dtype=np.uint8)
+    return np.zeros((rows, num_bytes(n)), dtype=np.uint8)
+
+
+def pack(bits):
+    '''
+    Packs a boolean array (or matrix, row-wise) into bitsets.
+    '''
+
+    return np.packbits(np.asarray(bits, dtype=bool), axis=-1)
+
+
+def unpack(bitset, n):
+    '''
+    Unpacks bitsets into a boolean array (or matrix) with n columns.
+    '''
+
+    return np.unpackbits(bitset, axis=-1)[..., :n].astype(bool)
+
+
+def from_indices(indices, n):
+    '''
+    Creates the bitset over n items containing the given indices.
+    '''
+
+    bits = np.zeros(n, dtype=bool)
+    bits[list(indices)] = True
+    return pack(bits)
+
+
+def members(bitset, n):
+    '''
+    Returns the sorted array of indices in the bitset.
+    '''
+
+    return np.flatnonzero(unpack(bitset, n))
+
+
+def contains(bitset, i):
+    '''
+    Returns whether item i is in the bitset.
+    '''
+
+    return bool(bitset[i >> 3] & (0x80 >> (i & 7)))
+
+
+def test(bitset, indices):
+    '''
+    Returns a boolean array telling for each of the indices whether it is
+    in the bitset.
+    '''
+
+    indices = np.asarray(indices, dtype=np.intp)
+    return (bitset[indices >> 3] & (0x80 >> (indices & 7))) != 0
+
+
+def add(bitset, i):
+    '''
+    Adds item i, or an array of items, to the bitset, in place.
+    '''
+
+    i = np.asarray(i, dtype=np.intp)
+    np.bitwise_or.at(bitset, i >> 3, (0x80 >> (i & 7)).astype(np.uint8))
+
+
+def discard(bitset, i):
+    '''
+    Removes item i, or an array of items, from the bitset, in place.
+    '''
+
+    i = np.asarray(i, dtype=np.intp)
+    np.bitwise_and.at(bitset, i >> 3, (~(0x80 >> (i & 7))).astype(np.uint8))
+
+
+def count(bitset):
+    '''
+    Returns the number of items in the bitset. For a matrix of bitsets an
+    array with the count of every row is returned.
+    '''
+
+    return POPCOUNT[bitset].sum(axis=-1)
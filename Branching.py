@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+'''
+Implements strategies to select the vertex to branch on in the 2-club search.
+
+Copyright (C) 2012  Steven Laan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see http://www.gnu.org/licenses/
+'''
+
+# 3rd party libraries
+import numpy as np
+
+# Own imports
+import Bitsets
+from Util import DROP, degeneracy_ordering
+
+
+class BranchingStrategy(object):
+
+    '''
+    Abstract base class for a branching strategy. A strategy selects an
+    undecided vertex of a node, which is then kept in one child and
+    removed in the other.
+    '''
+
+    def prepare(self, model):
+        '''
+        Precomputes data of the graph, called once by the model.
+
+        Parameters
+        ----------
+        model : TwoClubModel
+            The model using this strategy.
+        '''
+
+        pass
+
+    def select(self, model, node):
+        '''
+        Selects the vertex to branch on.
+
+        Parameters
+        ----------
+        model : TwoClubModel
+            The model using this strategy.
+        node : TwoClubNode
+            The materialized node to branch on.
+
+        Returns
+        -------
+        The vertex to branch on, or -1 if every participating vertex
+        reaches all others, i.e. the node is a leaf.
+        '''
+
+        raise NotImplementedError
+
+    def conflicting(self, node):
+        '''
+        Returns the undecided vertices that do not reach some participating
+        vertex. If there are none, the node is a leaf.
+        '''
+
+        return np.flatnonzero((node.info == 0) & (node.q > 0))
+
+    def best(self, candidates, *keys):
+        '''
+        Returns the candidate that is smallest in the given keys, the last
+        key being the most significant. Ties go to the lowest index.
+        '''
+
+        keys = [key[candidates] for key in keys]
+        return candidates[np.lexsort([candidates] + keys)[0]]
+
+
+class DropStrategy(BranchingStrategy):
+
+    '''
+    Branches on the vertex of maximal q-value with least degree, as in the
+    DROP heuristic.
+    '''
+
+    def select(self, model, node):
+        return DROP(node.q, node.degrees, node.info)
+
+
+class DegeneracyStrategy(BranchingStrategy):
+
+    '''
+    Branches on the conflicting vertex that comes first in a degeneracy
+    ordering of the graph.
+    '''
+
+    def prepare(self, model):
+        order = degeneracy_ordering(model.connectivity.neighbours)
+        self.position = np.empty(len(order), dtype=np.intp)
+        self.position[order] = np.arange(len(order))
+
+    def select(self, model, node):
+        candidates = self.conflicting(node)
+        if not len(candidates):
+            return -1
+        return self.best(candidates, self.position)
+
+
+class TwoDegreeStrategy(BranchingStrategy):
+
+    '''
+    Branches on the conflicting vertex with the most participating vertices
+    within distance 2, ties broken by the q-value.
+    '''
+
+    def select(self, model, node):
+        candidates = self.conflicting(node)
+        if not len(candidates):
+            return -1
+        two_degree = np.zeros(len(node.info), dtype=np.int64)
+        two_degree[candidates] = Bitsets.count(node.rows[candidates])
+        return self.best(candidates, -node.q, -two_degree)
+
+
+class FewestUndecidedStrategy(BranchingStrategy):
+
+    '''
+    Branches on the conflicting vertex with the fewest undecided
+    neighbours, ties broken by the q-value.
+    '''
+
+    def select(self, model, node):
+        candidates = self.conflicting(node)
+        if not len(candidates):
+            return -1
+        undecided = Bitsets.pack(node.info == 0)
+        adj = model.connectivity.adj[candidates]
+        count = np.zeros(len(node.info), dtype=np.int64)
+        count[candidates] = Bitsets.count(adj & undecided)
+        return self.best(candidates, -node.q, count)
+
+
+# The built-in strategies by name
+STRATEGIES = {
+    'drop': DropStrategy,
+    'degeneracy': DegeneracyStrategy,
+    'two-degree': TwoDegreeStrategy,
+    'fewest-undecided': FewestUndecidedStrategy,
+}
+
+
+def get_strategy(strategy):
+    '''
+    Returns a strategy instance for the given name. Instances are returned
+    unchanged.
+    '''
+
+    if isinstance(strategy, BranchingStrategy):
+        return strategy
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown branching strategy: %s' % (strategy,))
+    return STRATEGIES[strategy]()
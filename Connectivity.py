@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+'''
+Implements the maintenance of 2-hop connectivity under vertex removal.
+
+Copyright (C) 2012  Steven Laan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see http://www.gnu.org/licenses/
+'''
+
+# 3rd party libraries
+import numpy as np
+
+# Own imports
+import Bitsets
+from Drivers import adjacency_csr
+from Shared import SharedArrays
+
+
+class Connectivity(SharedArrays):
+
+    '''
+    Keeps the immutable adjacency structure of a graph and updates packed
+    2-hop connectivity rows when vertices are removed.
+
+    The connectivity rows have bit j of row i set when vertex j can be
+    reached from vertex i with a path of length 1 or 2 through the live
+    vertices. Vertex i reaches itself as soon as it has a live neighbour.
+    '''
+
+    def __init__(self, G):
+        '''
+        Creates the connectivity structure for the given graph.
+
+        Parameters
+        ----------
+        G : networkx.Graph
+            The graph, its vertices are numbered in the order of G.nodes().
+        '''
+
+        # Sorted adjacency lists, stored consecutively
+        self.indptr, self.indices = adjacency_csr(G)
+        self.n = len(self.indptr) - 1
+        self.degrees = np.diff(self.indptr).astype(np.int32)
+        self.neighbours = self.split_neighbours()
+
+        # Packed adjacency rows
+        self.adj = Bitsets.empty(self.n, self.n)
+        for i, nbrs in enumerate(self.neighbours):
+            Bitsets.add(self.adj[i], nbrs)
+
+    def split_neighbours(self):
+        '''
+        Returns the adjacency list of every vertex, as views of the
+        consecutively stored lists.
+        '''
+
+        return [self.indices[self.indptr[v]:self.indptr[v + 1]]
+                for v in xrange(self.n)]
+
+    def share(self, directory):
+        '''
+        Moves the adjacency structure to memory-mapped files in the given
+        directory, see SharedArrays.
+        '''
+
+        self.share_arrays(directory, ['adj', 'degrees', 'indptr', 'indices'])
+        self.neighbours = self.split_neighbours()
+
+    def __getstate__(self):
+        '''
+        Returns the state for pickling. The adjacency lists of a shared
+        structure are views of a shared array and are not pickled.
+        '''
+
+        state = super(Connectivity, self).__getstate__()
+        if 'indices' in state.get('shared', {}):
+            state['neighbours'] = None
+        return state
+
+    def __setstate__(self, state):
+        '''
+        Restores a pickled connectivity structure.
+        '''
+
+        super(Connectivity, self).__setstate__(state)
+        if self.neighbours is None:
+            self.neighbours = self.split_neighbours()
+
+    def two_hop_rows(self, live=None):
+        '''
+        Builds the packed connectivity rows of the graph, or of the graph
+        induced by the live vertices.
+
+        Each row is the union of the adjacency lists of the vertex and its
+        neighbours, so the total cost is O(sum of squared degrees) instead
+        of a dense matrix product.
+
+        Parameters
+        ----------
+        live : np.ndarray
+            The packed set of live vertices. Default None, all vertices.
+
+        Returns
+        -------
+        rows : np.ndarray
+            The packed connectivity rows, one per vertex. The rows of
+            vertices that are not live are empty.
+        '''
+
+        rows = Bitsets.empty(self.n, self.n)
+        vertices = xrange(self.n) if live is None else Bitsets.members(live, self.n)
+        for u in vertices:
+            nbrs = self.neighbours[u]
+            if live is not None:
+                nbrs = nbrs[Bitsets.test(live, nbrs)]
+            if not len(nbrs):
+                continue
+            reach = [nbrs]
+            reach.extend(self.neighbours[x] for x in nbrs)
+            Bitsets.add(rows[u], np.concatenate(reach))
+
+        if live is not None:
+            rows &= live
+        return rows
+
+    def remove(self, rows, live, v):
+        '''
+        Removes vertex v, updating the connectivity rows and the set of
+        live vertices in place.
+
+        Only pairs of live neighbours of v can lose their last path of
+        length 2, so only those pairs are checked for a remaining common
+        neighbour.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The packed connectivity rows.
+        live : np.ndarray
+            The packed set of live vertices, contains v.
+        v : int
+            The vertex to remove.
+
+        Returns
+        -------
+        changed : np.ndarray
+            The sorted live vertices whose rows lost vertices other than v.
+        '''
+
+        Bitsets.discard(live, v)
+        rows[v] = 0
+        rows[:, v >> 3] &= np.uint8(~(0x80 >> (v & 7)) & 0xff)
+
+        nbrs = self.neighbours[v]
+        nbrs = nbrs[Bitsets.test(live, nbrs)]
+        if not len(nbrs):
+            return nbrs
+
+        live_adj = self.adj[nbrs] & live
+
+        # Adjacent pairs stay connected, the others need a common live
+        # neighbour. The pair (u, u) stays iff u has a live neighbour.
+        candidates = np.triu(~Bitsets.unpack(self.adj[nbrs], self.n)[:, nbrs])
+
+        first, second = [], []
+        for a in np.flatnonzero(candidates.any(axis=1)):
+            others = np.flatnonzero(candidates[a])
+            common = np.any(live_adj[others] & live_adj[a], axis=1)
+            lost = others[~common]
+            first.append(np.repeat(a, len(lost)))
+            second.append(lost)
+
+        if not first:
+            return nbrs[:0]
+        first = nbrs[np.concatenate(first)]
+        second = nbrs[np.concatenate(second)]
+
+        np.bitwise_and.at(rows, (first, second >> 3),
+                          (~(0x80 >> (second & 7))).astype(np.uint8))
+        np.bitwise_and.at(rows, (second, first >> 3),
+                          (~(0x80 >> (first & 7))).astype(np.uint8))
+
+        return np.union1d(first, second)
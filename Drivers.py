@@ -21,10 +21,11 @@ along with this program.  If not, see http://www.gnu.org/licenses/
 import string
 import numpy as np
 from copy import deepcopy
+import multiprocessing as mp
 
 import networkx as nx
 
-def find_drivers(G):
+def find_drivers(G, processes=1):
     '''
     Finds the lifters and drivers in a graph.
 
@@ -32,6 +33,9 @@ def find_drivers(G):
     ----------
     G : networkx.Graph
         The graph to find the drivers of
+    processes : int
+        The number of processes to find the lifters with, see
+        find_lifters. Default 1.
 
     Returns
     -------
@@ -39,115 +43,302 @@ def find_drivers(G):
         A tuple containing the drivers and peers of the network.
         A driver is a node whose ego-network is not contained in
         the ego-network of any other node.
-        Peers are nodes whose ego-networks coincide. Only one of
-        the peers is mentioned in the driver set.
+        Peers are nodes whose neighbourhoods coincide apart from
+        each other, see find_drivers_id. Peers lift each other, so
+        none of them is in the driver set.
     '''
 
     nodes = G.nodes()
-    N = len(nodes)
-    A = nx.adjacency_matrix(G) + np.eye(N)
+    drivers, peers = find_drivers_id(G, processes)
+    drivers = dict((nodes[j], set(nodes[i] for i in lifters))
+                   for j, lifters in drivers.iteritems())
+    peers = dict((nodes[i], set(nodes[j] for j in twins))
+                 for i, twins in peers.iteritems())
+    return drivers, peers
+
+
+def adjacency_csr(G):
+    '''
+    Returns the adjacency structure of G in compressed sparse row form,
+    without self-loops. It is taken from a sparse matrix, so it is built
+    in O(n + m) without densifying.
 
-    items = dict()
-    driver_candidates = dict()
-    for i in xrange(N):
-        items[i] = set([j for j in xrange(N) if A[i,j]])
-        driver_candidates[nodes[i]] = set()
+    Parameters
+    ----------
+    G : networkx.Graph
+        The graph, its vertices are numbered in the order of G.nodes().
 
-    for i in xrange(N):
-        # Temporarily remove center
-        items[i].remove(i)
+    Returns
+    -------
+    (indptr, indices) : tuple
+        The sorted adjacency list of vertex v is
+        indices[indptr[v]:indptr[v + 1]].
+    '''
 
-        for j in xrange(N):
-            if i == j:
-                continue
+    A = nx.to_scipy_sparse_matrix(G, weight=None, format='csr')
+    A.sort_indices()
+    n = A.shape[0]
+    rows = np.repeat(np.arange(n), np.diff(A.indptr))
+    keep = A.indices != rows
 
-            # If all items of i are in j, i is a lifter of j
-            if items[i] < items[j]:
-                driver_candidates[nodes[j]].add(nodes[i])
+    indptr = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows[keep], minlength=n), out=indptr[1:])
+    return indptr, A.indices[keep].astype(np.intp)
 
-        # Add center back
-        items[i].add(i)
 
-    drivers = driver_candidates.copy()
-    peers = dict()
+def adjacency_lists(G):
+    '''
+    Returns the adjacency list of every vertex of G, without self-loops,
+    as views of the compressed sparse rows, see adjacency_csr.
+    '''
 
-    for i in xrange(N):
-        peers[nodes[i]] = set()
+    indptr, indices = adjacency_csr(G)
+    return [indices[indptr[v]:indptr[v + 1]] for v in xrange(len(indptr) - 1)]
 
-        for j in xrange(N):
-            if i == j:
-                continue
 
-            set_A = items[i] - set([nodes[j]])
-            set_B = items[j] - set([nodes[i]])
+def twin_classes(neighbours):
+    '''
+    Groups the vertices into classes of twins. Twins have the same
+    neighbours apart from each other: either the same closed
+    neighbourhood (adjacent twins) or the same neighbourhood (non-adjacent
+    twins). A vertex cannot have twins of both kinds.
 
-            if  set_A == set_B:
-                peers[nodes[i]].add(nodes[j])
-            elif nodes[i] in driver_candidates[nodes[j]]:
-                del drivers[nodes[i]]
-                break
+    The neighbourhoods are hashed, so this takes O(m log m) time.
 
-    return drivers, peers
+    Parameters
+    ----------
+    neighbours : list of np.ndarray
+        The adjacency list of every vertex, without self-loops.
+
+    Returns
+    -------
+    classes : list of lists
+        The sorted classes, ordered by their first vertex. Vertices
+        without twins form a class on their own.
+    '''
+
+    groups = dict()
+    for v, nbrs in enumerate(neighbours):
+        nbrs = np.sort(nbrs)
+        groups.setdefault((False, nbrs.tostring()), []).append(v)
+        closed = np.sort(np.append(nbrs, v))
+        groups.setdefault((True, closed.tostring()), []).append(v)
+
+    first = range(len(neighbours))
+    for group in groups.itervalues():
+        for v in group:
+            first[v] = min(first[v], group[0])
+
+    classes = dict()
+    for v, f in enumerate(first):
+        classes.setdefault(f, []).append(v)
+    return [classes[f] for f in sorted(classes)]
 
 
-def find_drivers_id(G):
+def reduce_twins(G):
     '''
-    Finds the lifters and drivers in a graph.
+    Collapses every class of twins of a graph into a single vertex.
+
+    A maximal 2-club with two or more vertices contains either all or
+    none of the twins of a class. So the maximal 2-clubs of G are found by
+    expanding those of the reduced graph. Classes without neighbours
+    outside the class, i.e. isolated vertices and components that are
+    cliques, are not collapsed, as their single vertex would be no 2-club.
 
     Parameters
     ----------
     G : networkx.Graph
-        The graph to find the drivers and lifters of
+        The graph to reduce.
 
     Returns
     -------
-    drivers : dict
-        dict containing IDs of the lifters of each driver
+    (Q, classes) : tuple
+        Q is the subgraph of G induced by the first vertex of every class.
+        classes[i] holds the indices in G.nodes() of the class of the
+        i-th vertex of Q.nodes().
     '''
 
     nodes = G.nodes()
-    N = len(nodes)
-    A = nx.adjacency_matrix(G) + np.eye(N)
+    index = dict((v, i) for i, v in enumerate(nodes))
+    neighbours = adjacency_lists(G)
+
+    by_first = dict()
+    for c in twin_classes(neighbours):
+        if set(neighbours[c[0]]) <= set(c):
+            by_first.update((v, [v]) for v in c)
+        else:
+            by_first[c[0]] = c
+    Q = G.subgraph([nodes[f] for f in by_first])
+    classes = [by_first[index[v]] for v in Q.nodes()]
+    return Q, classes
+
+
+def lifter_pairs(indptr, indices, vertices):
+    '''
+    Finds the vertices lifted by the given vertices. Vertex i is a lifter
+    of vertex j when the neighbourhood of i is contained in the closed
+    neighbourhood of j.
+
+    Only vertices within distance 2 of i can be lifted by it: they lie in
+    the closed neighbourhood of every neighbour of i. So the closed
+    neighbourhood of the neighbour of least degree is taken as the set of
+    candidates, and candidates with fewer than deg(i) - 1 neighbours are
+    skipped. For all candidates of i at once, the neighbours they share
+    with i are counted on a mark array, in which only the neighbours of i
+    are set. So the cost is proportional to the adjacency lists of the
+    candidates, and O(n + m) memory is needed.
+
+    Vertices without neighbours lift all other vertices, they are left to
+    find_lifters.
+
+    Parameters
+    ----------
+    indptr, indices : np.ndarray
+        The adjacency structure, see adjacency_csr.
+    vertices : iterable of ints
+        The vertices to find the lifted vertices of.
+
+    Returns
+    -------
+    (lifted, lifters) : tuple
+        Arrays of equal length, lifters[k] is a lifter of lifted[k].
+    '''
+
+    n = len(indptr) - 1
+    degrees = np.diff(indptr)
+    mark = np.zeros(n, dtype=bool)
+
+    lifted, lifters = [], []
+    for i in vertices:
+        nbrs = indices[indptr[i]:indptr[i + 1]]
+        if not len(nbrs):
+            continue
+
+        pivot = nbrs[np.argmin(degrees[nbrs])]
+        candidates = np.append(indices[indptr[pivot]:indptr[pivot + 1]], pivot)
+        candidates = candidates[(candidates != i) &
+                                (degrees[candidates] >= len(nbrs) - 1)]
+        if not len(candidates):
+            continue
+
+        # The adjacency lists of the candidates, one after another
+        lengths = degrees[candidates]
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        flat = indices[np.repeat(indptr[candidates] - starts, lengths) +
+                       np.arange(ends[-1])]
+
+        # N(i) is in N[j] iff all of N(i) is in N(j) or is j itself
+        mark[nbrs] = True
+        shared = np.concatenate(([0], np.cumsum(mark[flat])))
+        shared = shared[ends] - shared[starts] + mark[candidates]
+        mark[nbrs] = False
+        contained = candidates[shared == len(nbrs)]
+        lifted.append(contained)
+        lifters.append(np.repeat(i, len(contained)))
+
+    if not lifted:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    return np.concatenate(lifted), np.concatenate(lifters)
+
+
+# The adjacency structure used by the processes of the pool
+_adjacency = None
+
+def _init_lifter_worker(indptr, indices):
+    '''
+    Initializes a pool process with the adjacency structure.
+    '''
+
+    global _adjacency
+    _adjacency = (indptr, indices)
 
-    items = dict()
-    driver_candidates = dict()
-    for i in xrange(N):
-        items[i] = set([j for j in xrange(N) if A[i,j]])
-        driver_candidates[i] = set()
+def _lifter_chunk(vertices):
+    '''
+    Returns the lifter pairs of the given vertices.
+    '''
 
-    for i in xrange(N):
-        # Temporarily remove center
-        items[i].remove(i)
+    return lifter_pairs(_adjacency[0], _adjacency[1], vertices)
 
-        for j in xrange(N):
-            if i == j:
-                continue
 
-            # If all items of i are in j, i is a lifter of j
-            if items[i] < items[j]:
-                driver_candidates[j].add(i)
+def find_lifters(indptr, indices, processes=1):
+    '''
+    Finds the lifters of every vertex, see lifter_pairs.
 
-        # Add center back
-        items[i].add(i)
+    Parameters
+    ----------
+    indptr, indices : np.ndarray
+        The adjacency structure, see adjacency_csr.
+    processes : int
+        The number of processes finding the lifters of chunks of the
+        vertices in parallel. Default 1, find all lifters in this process.
 
-    drivers = driver_candidates.copy()
-    peers = dict()
+    Returns
+    -------
+    lifters : list of sets
+        The lifters of every vertex.
+    '''
+
+    n = len(indptr) - 1
+    if processes <= 1:
+        results = [lifter_pairs(indptr, indices, xrange(n))]
+    else:
+        # Interleaved chunks, so that vertices of high degree, which are
+        # often numbered first, are spread over the processes
+        count = min(4 * processes, n)
+        chunks = [np.arange(k, n, count) for k in xrange(count)]
+        pool = mp.Pool(processes, _init_lifter_worker, (indptr, indices))
+        results = pool.map(_lifter_chunk, chunks)
+        pool.close()
+        pool.join()
+
+    # The empty neighbourhood is contained in every other one
+    isolated = np.flatnonzero(np.diff(indptr) == 0).tolist()
+    lifters = [set(isolated) for _ in xrange(n)]
+    for i in isolated:
+        lifters[i].discard(i)
+
+    for lifted, lifting in results:
+        for j, i in zip(lifted.tolist(), lifting.tolist()):
+            lifters[j].add(i)
+    return lifters
+
+
+def find_drivers_id(G, processes=1):
+    '''
+    Finds the lifters and drivers in a graph.
+
+    Parameters
+    ----------
+    G : networkx.Graph
+        The graph to find the drivers and lifters of
+    processes : int
+        The number of processes to find the lifters with, see
+        find_lifters. Default 1.
 
-    for i in xrange(N):
-        peers[i] = set()
+    Returns
+    -------
+    (drivers, peers) : tuple
+        dict containing IDs of the lifters of each driver, and dict
+        containing IDs of the twins of each vertex
+    '''
 
-        for j in xrange(N):
-            if i == j:
-                continue
+    indptr, indices = adjacency_csr(G)
+    neighbours = [indices[indptr[v]:indptr[v + 1]]
+                  for v in xrange(len(indptr) - 1)]
+    lifters = find_lifters(indptr, indices, processes)
 
-            set_A = items[i] - set([j])
-            set_B = items[j] - set([i])
+    # A vertex that lifts another vertex is no driver
+    lifting = set()
+    for ls in lifters:
+        lifting.update(ls)
+    drivers = dict((j, ls) for j, ls in enumerate(lifters)
+                   if j not in lifting)
 
-            if  set_A == set_B:
-                peers[i].add(j)
-            elif i in driver_candidates[j]:
-                del drivers[i]
-                break
+    # Peers are twins, see reduce_twins for their removal
+    peers = dict()
+    for twins in twin_classes(neighbours):
+        for i in twins:
+            peers[i] = set(twins) - set([i])
 
-    # TODO: Remove peers to obtain minimal driver set
     return drivers, peers
@@ -18,59 +18,109 @@ along with this program.  If not, see http://www.gnu.org/licenses/
 '''
 
 # Python imports
-import sys
 import time
+import itertools
+import shutil
+import tempfile
 import pickle
-import subprocess
 import argparse
 import multiprocessing as mp
-from copy import deepcopy
 
 # 3rd party libaries
+import numpy as np
 import networkx as nx
-import BitVector as bv
 
 # Own imports
-from MasterHub import Master, Node, Model
+import Bitsets
+from Connectivity import Connectivity
+from Shared import SharedArrays
+from Maximality import maximal_sets
+from MasterHub import Master, Node, Model, WorkStealing, search, read_answers
+from MasterHub import auto_hubs, format_report
+from Branching import STRATEGIES, get_strategy
 
 from Util import *
-from Drivers import find_drivers_id
+from Drivers import find_drivers_id, reduce_twins
 
 
 class TwoClubNode(Node):
 
     '''
     A node in the 2-club search tree.
+
+    A node either holds its full state (rows, info, q and degrees) or only
+    the delta with respect to its parent: the vertex that is kept and the
+    vertices that are removed. The state of a delta node is reconstructed
+    by the model when the node is processed, see
+    TwoClubModel.materialize.
+
+    A compact node has no parent and only lists its participating vertices
+    or only has its info vector, its state is rebuilt from the graph.
     '''
 
-    def __init__(self, C, info, terminal):
+    def __init__(self, rows, info, terminal, q=None, degrees=None):
         '''
         Creates a TwoClubNode.
 
         Parameters
         ----------
-        C : np.matrix
-            The connectivity matrix associated with this node.
-        info : list
+        rows : np.ndarray
+            The connectivity of this node as a matrix of packed bitsets.
+            Row i holds the vertices that are within distance 2 of
+            vertex i in the graph induced by the participating vertices.
+        info : np.ndarray
             The information for which vertices are in the current
-            solution, which are out and which are still undecided.
+            solution (1), which are out (-1) and which are still
+            undecided (0).
         terminal : bool
             Whether this node is a leaf node of the tree.
+        q : np.ndarray
+            For every participating vertex the number of participating
+            vertices it does not reach, 0 for the other vertices.
+        degrees : np.ndarray
+            The degree of every vertex in the graph induced by the
+            participating vertices.
         '''
 
         super(TwoClubNode, self).__init__(terminal)
 
         self.info = info
-        self.C = C
+        self.rows = rows
+        self.q = q
+        self.degrees = degrees
+
+        # Delta with respect to the parent
+        self.parent = None
+        self.kept = -1
+        self.removed = ()
+        self.depth = 0
+        self.anchor = True
+
+        # Participating vertices of a compact node
+        self.members = None
+
+    def __getstate__(self):
+        '''
+        Returns the state for pickling, without the parent.
+        '''
+
+        if self.info is None and self.members is None:
+            raise ValueError('Delta nodes have to be exported by the model '
+                             'before they can be pickled')
+
+        state = self.__dict__.copy()
+        state['parent'] = None
+        return state
 
-class TwoClubModel(Model):
+class TwoClubModel(Model, SharedArrays):
 
     '''
     The tree search model for the all 2-clubs problem. It specifies the initial
     state and how to expand nodes.
     '''
 
-    def __init__(self, G):
+    def __init__(self, G, anchor_interval=4, decompose=False,
+                 strategy='drop', processes=1):
         '''
         Creates a TwoClubProblem for the given graph.
 
@@ -78,24 +128,320 @@ class TwoClubModel(Model):
         ----------
         G : networkx.Graph
             The graph to find the 2-clubs of.
+        anchor_interval : int
+            Every this many levels of the search tree a node keeps its full
+            state while it has unprocessed descendants. Other nodes hand
+            their state to their first child and are reconstructed from
+            the nearest such anchor. Default 4.
+        decompose : bool
+            Whether to split the search into one independent subproblem per
+            vertex, see get_roots. Default False.
+        strategy : str or BranchingStrategy
+            The strategy that selects the vertex to branch on, either an
+            instance or the name of a built-in strategy, see
+            Branching.STRATEGIES. Default 'drop'.
+        processes : int
+            The number of processes to find the drivers with, see
+            Drivers.find_lifters. Default 1.
         '''
 
         n = nx.number_of_nodes(G)
-        self.drivers, _ = find_drivers_id(G)
-        Adj = nx.adj_matrix(G)
+        self.connectivity = Connectivity(G)
+        self.anchor_interval = anchor_interval
+        self.decompose = decompose
+
+        # The lifters of driver v are lifters[lifter_ptr[v]:lifter_ptr[v + 1]]
+        drivers, _ = find_drivers_id(G, processes)
+        self.lifter_ptr = np.zeros(n + 1, dtype=np.intp)
+        for v, lifters in drivers.iteritems():
+            self.lifter_ptr[v + 1] = len(lifters)
+        np.cumsum(self.lifter_ptr, out=self.lifter_ptr)
+        self.lifters = np.zeros(self.lifter_ptr[-1], dtype=np.intp)
+        for v, lifters in drivers.iteritems():
+            self.lifters[self.lifter_ptr[v]:self.lifter_ptr[v + 1]] = sorted(lifters)
+
+        # Distance 2 neighbourhoods in the whole graph, never modified
+        self.reach = self.connectivity.two_hop_rows()
+
+        self.strategy = get_strategy(strategy)
+        self.strategy.prepare(self)
+
+    def child(self, node, kept, removed):
+        '''
+        Creates a delta encoded child of a node.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The parent node.
+        kept : int
+            The vertex that is added to the solution, -1 for none.
+        removed : list of ints
+            The vertices that are removed.
+        '''
+
+        child = TwoClubNode(None, None, False)
+        child.parent = node
+        child.kept = kept
+        child.removed = removed
+        child.depth = node.depth + 1
+        child.anchor = child.depth % self.anchor_interval == 0
+        return child
+
+    def apply(self, node, kept, removed):
+        '''
+        Applies a delta to the state of a node, in place.
+
+        The q-values and degrees are updated incrementally. Only the rows
+        that lose vertices other than the removed ones get their q-value
+        recounted. Likewise, the node is known to be feasible, so only the
+        kept vertices among those rows can become infeasible.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The node holding the state to update.
+        kept : int
+            The vertex that is added to the solution, -1 for none.
+        removed : list of ints
+            The vertices that are removed.
+
+        Returns
+        -------
+        feasible : bool
+            Whether the resulting state is feasible. If not, the state of
+            the node is left inconsistent.
+        '''
+
+        rows, info, q, degrees = node.rows, node.info, node.q, node.degrees
+        if kept >= 0:
+            info[kept] = 1
+
+        n = len(info)
+        live = Bitsets.pack(info >= 0)
+        keep = Bitsets.pack(info == 1)
+
+        changed = set()
+        for v in removed:
+            # Vertices that did not reach v have one unreachable vertex less
+            gone = live & ~rows[v]
+            Bitsets.discard(gone, v)
+            q[Bitsets.members(gone, n)] -= 1
+
+            nbrs = self.connectivity.neighbours[v]
+            degrees[nbrs[Bitsets.test(live, nbrs)]] -= 1
+
+            lost = self.connectivity.remove(rows, live, v)
+            if np.any(keep & ~rows[[u for u in lost if info[u] == 1]]):
+                # Unfeasible
+                return False
+
+            changed.update(lost)
+            info[v] = -1
+            q[v] = 0
+            degrees[v] = 0
+
+        changed = [u for u in changed if info[u] >= 0]
+        if changed:
+            q[changed] = Bitsets.count(live & ~rows[changed])
+
+        return True
+
+    def rebuild(self, node):
+        '''
+        Builds the full state of a compact node from the graph.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The compact node.
+
+        Returns
+        -------
+        feasible : bool
+            Whether the node is feasible.
+        '''
+
+        if node.members is not None:
+            info = np.empty(self.connectivity.n, dtype=np.int8)
+            info.fill(-1)
+            info[node.members] = 0
+            if node.kept >= 0:
+                info[node.kept] = 1
+            node.info = info
+            node.members = None
 
-        # Create the individual adjacency matrices
-        self.A = dict()
-        for i in xrange(n):
-            self.A[i] = Adj[i,:].transpose() * Adj[i,:]
+        info = node.info
+        live = Bitsets.pack(info >= 0)
 
-        # Connectivity matrix
-        C = Adj + Adj * Adj
-        del Adj
+        node.rows = self.connectivity.two_hop_rows(live)
+        node.q = q_values(node.rows, live)
+        node.degrees = Bitsets.count(self.connectivity.adj & live)
+        node.degrees = node.degrees.astype(np.int32)
+        node.degrees[info < 0] = 0
 
-        # First info vector
-        info = [0 for i in xrange(n)]
-        self.first_node = TwoClubNode(C, info, False)
+        keep = np.flatnonzero(info == 1)
+        return not np.any(Bitsets.pack(info == 1) & ~node.rows[keep])
+
+    def materialize(self, node):
+        '''
+        Reconstructs the full state of a delta encoded node.
+
+        If the parent still holds its state and is not an anchor, the state
+        is taken over without copying. Otherwise the state of the nearest
+        ancestor holding one is copied and the deltas on the path down are
+        replayed. Compact nodes are rebuilt from the graph.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The node to materialize.
+
+        Returns
+        -------
+        feasible : bool
+            Whether the node is feasible.
+        '''
+
+        if node.rows is not None:
+            return True
+        if node.parent is None:
+            return self.rebuild(node)
+
+        path = []
+        source = node
+        while source.rows is None:
+            path.append(source)
+            source = source.parent
+
+        state = (source.rows, source.info, source.q, source.degrees)
+        if len(path) == 1 and not source.anchor:
+            source.rows = source.info = source.q = source.degrees = None
+        else:
+            state = [x.copy() for x in state]
+        node.rows, node.info, node.q, node.degrees = state
+
+        for step in reversed(path):
+            if not self.apply(node, step.kept, step.removed):
+                return False
+
+        return True
+
+    def dominated(self, node):
+        '''
+        Checks whether every solution in the subtree of a node is contained
+        in a larger 2-club, so the subtree can be pruned.
+
+        That is the case when some vertex w that is out of the solution is
+        adjacent to all kept vertices, and every participating vertex is
+        adjacent to w or to a kept vertex. Then w is within distance 2 of
+        all members of any 2-club in the subtree, so it can be added.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The (materialized) node to check.
+        '''
+
+        info = node.info
+        n = len(info)
+        adj = self.connectivity.adj
+        live = Bitsets.pack(info >= 0)
+        kept = np.flatnonzero(info == 1)
+
+        if len(kept):
+            # Removed vertices adjacent to all kept vertices
+            common = np.bitwise_and.reduce(adj[kept]) & ~live
+            candidates = Bitsets.members(common, n)
+            live &= ~np.bitwise_or.reduce(adj[kept])
+        else:
+            size = np.count_nonzero(info >= 0)
+            candidates = np.flatnonzero((info < 0) &
+                                        (self.connectivity.degrees >= size))
+
+        if not len(candidates):
+            return False
+
+        outside = live & ~adj[candidates]
+        return not np.all(np.any(outside, axis=1))
+
+    def extendable(self, node):
+        '''
+        Checks whether the solution of a leaf node is not maximal, because
+        some vertex that is out of the solution is within distance 2 of all
+        its members in the graph induced by the solution and that vertex.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The (materialized) leaf node to check.
+        '''
+
+        info = node.info
+        n = len(info)
+        live = Bitsets.pack(info >= 0)
+        adj = self.connectivity.adj
+
+        # Cheap filter on the distance in the whole graph
+        candidates = np.flatnonzero(info < 0)
+        outside = live & ~self.reach[candidates]
+        candidates = candidates[~np.any(outside, axis=1)]
+
+        for w in candidates:
+            nbrs = adj[w] & live
+            reach = nbrs | np.bitwise_or.reduce(adj[Bitsets.members(nbrs, n)])
+            if not np.any(live & ~reach):
+                return True
+
+        return False
+
+    def export_node(self, node):
+        '''
+        Flattens a node into compact form, such that it can be sent to
+        another process, which rebuilds its state from the graph.
+
+        Only the info vector is derived: the deltas on the path from the
+        nearest ancestor holding a state are replayed on a copy of its
+        info. This is much cheaper than materializing the node and
+        sending its rows. The receiver finds out whether it is feasible.
+
+        Parameters
+        ----------
+        node : TwoClubNode
+            The node to export.
+
+        Returns
+        -------
+        node : TwoClubNode
+            The compact node. Compact nodes are returned unchanged.
+        '''
+
+        if node.parent is None and node.rows is None:
+            return node
+
+        path = []
+        source = node
+        while source.rows is None:
+            path.append(source)
+            source = source.parent
+
+        info = source.info.copy()
+        for step in reversed(path):
+            if step.kept >= 0:
+                info[step.kept] = 1
+            info[list(step.removed)] = -1
+
+        compact = TwoClubNode(None, info, False)
+        compact.depth = node.depth
+        return compact
+
+    def checkpoint_node(self, node):
+        '''
+        Reduces a node to its info vector, which is all that is needed to
+        rebuild it, see export_node.
+        '''
+
+        return self.export_node(node)
 
     def process_node(self, node_to_process):
         '''
@@ -113,64 +459,41 @@ class TwoClubModel(Model):
             Can be empty.
         '''
 
-        C = node_to_process.C
-        info = node_to_process.info
+        # Children are checked for feasibility when they are reconstructed
+        if not self.materialize(node_to_process):
+            return []
 
-        # Number of nodes
-        n = len(info)
+        # Prune subtrees that only contain non-maximal 2-clubs
+        if self.dominated(node_to_process):
+            return []
 
-        # Feasibility check
-        keep = [i for i in xrange(n) if info[i] == 1]
-        for i in keep:
-            for j in keep:
-                if C[i,j] == 0:
-                    # Unfeasible
-                    return []
+        rows = node_to_process.rows
+        info = node_to_process.info
 
-        # Call DROP to branch
-        to_remove = DROP(C, info)
+        # Select the vertex to branch on
+        to_remove = self.strategy.select(self, node_to_process)
 
-        # Termination check
+        # Termination check, non-maximal leaves are discarded
         if to_remove == -1:
+            if self.extendable(node_to_process):
+                return []
             return [TwoClubNode(None, info, True)]
 
         new_nodes = []
 
         # Branch 2
-        keep_info = list(info)
-        keep_info[to_remove] = 1
-        keep_C = deepcopy(C)
-
         # Remove nodes that are not in the 2 neigborhood
-        feasible = True
-        for i in xrange(n):
-            if C[i,to_remove] == 0:
-                if keep_info[i] == 1:
-                    feasible = False
-                    break
-                elif keep_info[i] == 0:
-                    # Update problem parameters
-                    keep_C -= self.A[i]
-                    keep_info[i] = -1
-        if feasible:
-            new_nodes.append(TwoClubNode(keep_C, keep_info, False))
+        live = Bitsets.pack(info >= 0)
+        outside = Bitsets.members(live & ~rows[to_remove], len(info))
+        if to_remove not in outside and not np.any(info[outside] == 1):
+            new_nodes.append(self.child(node_to_process, to_remove, outside))
 
         # Branch 1
-        feasible = True
-        to_remove_list = [to_remove]
-        if to_remove in self.drivers:
-            for lifter in self.drivers[to_remove]:
-                if info[lifter] == 1:
-                    feasible = False
-                    break
-                elif info[lifter] == 0:
-                    to_remove_list.append(lifter)
-        if feasible:
-            rem_C = deepcopy(C)
-            for node in to_remove_list:
-                rem_C -= self.A[node]
-                info[node] = -1
-            new_nodes.append(TwoClubNode(rem_C, list(info), False))
+        lifters = self.lifters[self.lifter_ptr[to_remove]:
+                               self.lifter_ptr[to_remove + 1]]
+        if not np.any(info[lifters] == 1):
+            to_remove_list = [to_remove] + lifters[info[lifters] == 0].tolist()
+            new_nodes.append(self.child(node_to_process, -1, to_remove_list))
 
         return new_nodes
 
@@ -179,10 +502,68 @@ class TwoClubModel(Model):
         Returns the root node of the search tree.
         '''
 
-        return self.first_node
+        n = self.connectivity.n
+        info = np.zeros(n, dtype=np.int8)
+        rows = np.array(self.reach)
+        live = Bitsets.pack(info >= 0)
+        degrees = self.connectivity.degrees.copy()
+        return TwoClubNode(rows, info, False, q_values(rows, live), degrees)
+
+    def compact_answer(self, node):
+        '''
+        Returns the packed set of vertices of a candidate.
+        '''
 
+        return Bitsets.pack(node.info >= 0)
 
-def find_candidates(G, hubs):
+    def share(self, directory):
+        '''
+        Moves the graph data, which never changes during the search, to
+        memory-mapped files in the given directory. Processes that receive
+        the model map these files instead of holding their own copy.
+        '''
+
+        self.connectivity.share(directory)
+        self.share_arrays(directory, ['reach', 'lifter_ptr', 'lifters'])
+
+    def get_roots(self):
+        '''
+        Returns the root nodes of the search.
+
+        In decomposition mode every 2-club is searched for from its first
+        member in a degeneracy ordering of the vertices. The subproblem of
+        vertex v keeps v and only considers the later vertices within
+        distance 2 of v, so the subproblems are small and independent.
+        Otherwise the single root of the search tree is returned.
+        '''
+
+        if not self.decompose:
+            return [self.get_root()]
+
+        n = self.connectivity.n
+        order = degeneracy_ordering(self.connectivity.neighbours)
+        position = np.empty(n, dtype=np.intp)
+        position[order] = np.arange(n)
+
+        roots = []
+        for v in order:
+            later = position > position[v]
+            members = np.flatnonzero(Bitsets.unpack(self.reach[v], n) & later)
+            if not len(members):
+                continue
+
+            root = TwoClubNode(None, None, False)
+            root.kept = v
+            root.members = np.append(members, v)
+            roots.append(root)
+
+        return roots
+
+
+def find_candidates(G, hubs, decompose=False, stealing=False, spill=None,
+                    checkpoint=None, interval=600, resume=False,
+                    address=None, authkey=None, remote_hubs=0,
+                    report_file=None, stats=False, strategy='drop'):
     '''
     Find the candidate 2-clubs for the given graph using the specified
     hub-structure.
@@ -194,24 +575,141 @@ def find_candidates(G, hubs):
     hubs: List of integers
         The hub structure. Each list item is a hub,
         the value of each item specifies the number of workers.
+        If None, the structure is derived from the number of CPUs and
+        the queue lengths are tuned during the search.
+    decompose : bool
+        Whether to search one independent subproblem per vertex.
+        Default False.
+    stealing : bool
+        Whether to use the work-stealing scheduler, with as many workers
+        as the hub structure, instead of the hubs. Default False.
+    spill : str
+        If given, the workers write the candidates to files in this
+        directory during the search. Default None.
+    checkpoint : str
+        If given, the search is checkpointed in this directory and the
+        candidates are spilled to it. Not supported with stealing.
+        Default None.
+    interval : float
+        The number of seconds between checkpoints. Default 600.
+    resume : bool
+        Whether to resume the search of the same graph from the checkpoint
+        directory. Default False.
+    address : tuple
+        The (host, port) to listen on for remote hubs. Default None.
+    authkey : str
+        The key remote hubs authenticate with, must be given with remote
+        hubs. Default None.
+    remote_hubs : int
+        The number of hubs on other hosts, started with
+        'python MasterHub.py host:port workers'. Default 0.
+    report_file : str
+        If given, the statistics of the processes are written to this file
+        during the search, see Master. Default None.
+    stats : bool
+        Whether to return the statistics of the search as well. Default
+        False.
+    strategy : str or BranchingStrategy
+        The branching strategy, see TwoClubModel. Default 'drop'.
 
     Returns
     -------
     A tuple (time, candidates), wehere time is the time the computation took
-    and candidates is the list of candidates.
+    and candidates is the list of candidates. If the candidates are
+    spilled, candidates is a generator of their packed vertex sets.
+    If stats is True, the tuple (time, candidates, report) is returned,
+    where report holds the statistics of all processes, or None for
+    the work-stealing scheduler.
     '''
 
-    # Instantiate the model with the given graph
-    model = TwoClubModel(G)
+    if checkpoint is not None:
+        if stealing:
+            raise ValueError('Checkpoints are not supported with work stealing')
+        spill = checkpoint
+    if remote_hubs and not authkey:
+        raise ValueError('Remote hubs need a non-empty authkey')
+
+    max_len = 8
+    if hubs is None:
+        hubs = auto_hubs()
+        max_len = None
+
+    # Instantiate the model with the given graph, finding the drivers on
+    # as many processes as there are local workers
+    model = TwoClubModel(G, decompose=decompose, strategy=strategy,
+                         processes=sum(hubs))
 
     # Store the current time and start the computation
     t = time.time()
-    m = Master(model, hubs, max_len = 8)
 
-    return time.time() - t, m.answers
+    # The processes map the graph data instead of copying it, remote hubs
+    # receive the full model and share it on their own host
+    directory = tempfile.mkdtemp()
+    try:
+        if not remote_hubs:
+            model.share(directory)
+        if stealing:
+            m = WorkStealing(model, sum(hubs), spill = spill)
+        else:
+            m = Master(model, hubs, max_len = max_len, spill = spill,
+                       checkpoint = checkpoint, interval = interval,
+                       resume = resume, address = address,
+                       authkey = authkey, remote_hubs = remote_hubs,
+                       report_file = report_file)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result = (time.time() - t, m.answers)
+    if spill is not None:
+        # Remote hubs send their answers back instead of spilling them
+        remote = (model.compact_answer(node) for node in m.answers)
+        result = (result[0], itertools.chain(read_answers(spill), remote))
+    if stats:
+        result += (getattr(m, 'report', None),)
+    return result
+
+
+def benchmark_strategies(G, strategies=None, decompose=False):
+    '''
+    Compares branching strategies on the given graph. Each strategy is
+    used for a full search in the current process.
+
+    Parameters
+    ----------
+    G : NetworkX Graph
+        The input graph
+    strategies : list
+        The strategies to compare, names or instances. Default None, all
+        built-in strategies.
+    decompose : bool
+        Whether to search one independent subproblem per vertex.
+        Default False.
+
+    Returns
+    -------
+    A list of tuples (strategy, nodes, candidates, time), where nodes is
+    the number of processed nodes of the search tree, candidates the number
+    of leaves found and time the duration of the search in seconds.
+    '''
+
+    if strategies is None:
+        strategies = sorted(STRATEGIES)
+
+    results = []
+    for strategy in strategies:
+        model = TwoClubModel(G, decompose=decompose, strategy=strategy)
 
+        t = time.time()
+        answers, processed = search(model)
+        results.append((strategy, processed, len(answers), time.time() - t))
 
-def find_clubs(G, hubs):
+    return results
+
+
+def find_clubs(G, hubs, directory=None, decompose=False, stealing=False,
+               checkpoint=None, interval=600, resume=False,
+               address=None, authkey=None, remote_hubs=0, report_file=None,
+               twins=False, strategy='drop'):
     '''
     Find the 2-clubs of the given graph using the specified hub-structure.
 
@@ -222,27 +720,74 @@ def find_clubs(G, hubs):
     hubs: List of integers
         The hub structure. Each list item is a hub,
         the value of each item specifies the number of workers.
+        If None, the structure is chosen automatically, see
+        find_candidates.
+    directory : str
+        If given, the candidates are kept in memory-mapped files in a
+        temporary directory inside this directory during the maximality
+        check, which is removed afterwards. Default None.
+    decompose : bool
+        Whether to search one independent subproblem per vertex.
+        Default False.
+    stealing : bool
+        Whether to use the work-stealing scheduler. Default False.
+    checkpoint : str
+        If given, the search is checkpointed in this directory, see
+        find_candidates. The directory is kept afterwards. Default None.
+    interval : float
+        The number of seconds between checkpoints. Default 600.
+    resume : bool
+        Whether to resume an interrupted search from the checkpoint
+        directory. Default False.
+    address, authkey, remote_hubs :
+        The setup for hubs on other hosts, see find_candidates.
+    report_file : str
+        If given, the statistics of the search are written to this file
+        and a summary per worker is printed. Default None.
+    twins : bool
+        Whether to collapse the twins of the graph before the search, see
+        Drivers.reduce_twins. The clubs are expanded again afterwards.
+        Default False.
+    strategy : str or BranchingStrategy
+        The branching strategy, see TwoClubModel. Default 'drop'.
 
     Returns
     -------
     Nothing (at the moment). The found 2-clubs are stored in
     'maximal_clubs.result'
-    '''
-    time, candidates = find_candidates(G, hubs)
-
-    answers = []
-    for ans in candidates:
-        answers.append(bv.BitVector(bitlist = [make_binary(i) for i in ans.info]))
 
-    new_data, sorted_data = prepare_for_check(answers)
-    write_sets_binary(new_data, 'binary_file.temp')
-
-    if sys.platform.startswith('linux'):
-        subprocess.check_call(['./ams-cardinality','binary_file.temp'])
-    elif sys.platform.startswith('win'):
-        subprocess.check_call(['ams-cardinality.exe','binary_file.temp'])
-
-    post_process(G, sorted_data, open('output.txt', 'r' ))
+    Notes
+    -----
+    The maximality check runs on as many processes as there are workers.
+    The candidates are streamed from disk into the check, so they are
+    never all held as search nodes at once.
+    '''
+    H, classes = G, None
+    if twins:
+        H, classes = reduce_twins(G)
+
+    spill = checkpoint
+    if checkpoint is None:
+        spill = tempfile.mkdtemp(dir=directory)
+    index = None
+    if directory is not None:
+        index = tempfile.mkdtemp(dir=directory)
+    try:
+        time, candidates, report = find_candidates(H, hubs, decompose,
+            stealing, spill, checkpoint, interval, resume, address, authkey,
+            remote_hubs, report_file, stats=True, strategy=strategy)
+        if report_file is not None and report is not None:
+            print format_report(report)
+
+        # Filter out the non-maximal candidates
+        data, maximal = maximal_sets(candidates, nx.number_of_nodes(H),
+                                     index, processes=sum(hubs or auto_hubs()))
+        post_process(G, data, maximal, classes)
+    finally:
+        if checkpoint is None:
+            shutil.rmtree(spill, ignore_errors=True)
+        if index is not None:
+            shutil.rmtree(index, ignore_errors=True)
 
 
 if __name__ == '__main__':
@@ -250,22 +795,69 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Compute 2-clubs of a graph.')
     parser.add_argument('graph')
-    parser.add_argument('hubs', metavar='Hub', type=int, nargs='+',
-                       help='number of workers for the hub')
+    parser.add_argument('hubs', metavar='Hub', type=int, nargs='*',
+                       help='number of workers for the hub. Default: derived '
+                            'from the number of CPUs')
     group = parser.add_argument_group()
     group.add_argument('-b','--borough', help='The borough result file to use.')
     group.add_argument('-bn','--borough_number',
         help='The id number of the borough. Default 0 = largest.', default = 0)
+    parser.add_argument('-d', '--decompose', action='store_true',
+        help='Search one independent subproblem per vertex.')
+    parser.add_argument('-s', '--stealing', action='store_true',
+        help='Use work stealing between the workers instead of hubs.')
+    parser.add_argument('--directory',
+        help='Directory to keep the candidates in during the maximality '
+             'check, which bounds the memory use for many candidates.')
+    parser.add_argument('-c', '--checkpoint',
+        help='Directory to checkpoint the search in.')
+    parser.add_argument('--interval', type=float, default=600,
+        help='Seconds between checkpoints. Default 600.')
+    parser.add_argument('-r', '--resume', action='store_true',
+        help='Resume the search from the checkpoint directory.')
+    parser.add_argument('--listen', default='localhost:5000',
+        help='host:port to listen on for remote hubs.')
+    parser.add_argument('--remote-hubs', type=int, default=0,
+        help='Number of hubs on other hosts, see MasterHub.py.')
+    parser.add_argument('-k', '--authkey',
+        help='The key remote hubs authenticate with, required with '
+             '--remote-hubs.')
+    parser.add_argument('-t', '--twins', action='store_true',
+        help='Collapse twin vertices before the search.')
+    parser.add_argument('--report',
+        help='File to write the statistics of the search to.')
+    parser.add_argument('--strategy', default='drop',
+        choices=sorted(STRATEGIES),
+        help='The branching strategy. Default drop.')
+    parser.add_argument('--benchmark', action='store_true',
+        help='Compare the branching strategies instead of finding clubs.')
 
     args = parser.parse_args()
+    if args.remote_hubs and not args.authkey:
+        parser.error('--remote-hubs requires a non-empty --authkey')
 
     G = nx.read_graphml(args.graph)
 
     if args.borough:
         boroughs = pickle.load(open(args.borough))
-        B = nx.Graph()
-        B.add_edges_from(boroughs[args.borough_number])
-        find_clubs(B, args.hubs)
+        G = nx.Graph()
+        G.add_edges_from(boroughs[args.borough_number])
+
+    if args.benchmark:
+        print '%-18s %10s %10s %10s' % ('Strategy', 'Nodes', 'Leaves', 'Time')
+        for result in benchmark_strategies(G, decompose=args.decompose):
+            print '%-18s %10d %10d %10.2f' % result
     else:
-        find_clubs(G, args.hubs)
+        host, port = args.listen.rsplit(':', 1)
+
+        # Run the importable module, so that remote hubs can unpickle the
+        # model sent to them
+        import FindAllClubs
+        FindAllClubs.find_clubs(G, args.hubs or None, args.directory,
+                   decompose=args.decompose,
+                   stealing=args.stealing, checkpoint=args.checkpoint,
+                   interval=args.interval, resume=args.resume,
+                   address=(host, int(port)), authkey=args.authkey,
+                   remote_hubs=args.remote_hubs, report_file=args.report,
+                   twins=args.twins, strategy=args.strategy)
 
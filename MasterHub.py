@@ -17,22 +17,325 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see http://www.gnu.org/licenses/
 '''
 
+import os
+import glob
+import time
+import random
+import shutil
+import socket
+import json
+import cPickle
+import tempfile
+import threading
 import multiprocessing as mp
 
-from Queue import Empty
-from copy import deepcopy
+from Queue import Empty, Queue
+from collections import deque
+from fractions import Fraction
+from multiprocessing.managers import BaseManager
 
-# Define signals
-SIGNAL_NODE = 0
+# Define signals. Jobs (SIGNAL_NODES) carry a share of the credit of the
+# search, idle workers return their credit (SIGNAL_IDLE). The search is done
+# when the master has all credit back.
 SIGNAL_DONE = 1
 SIGNAL_IDLE = 2
-SIGNAL_BUSY = 3
 SIGNAL_ANSWERS = 4
+SIGNAL_TASK = 5
+SIGNAL_NODES = 6
+SIGNAL_STEAL = 7
+SIGNAL_LOOT = 8
+SIGNAL_STATS = 9
 
 # Define shorthands
-SIG_IDLE = (SIGNAL_IDLE, None)
 SIG_DONE = (SIGNAL_DONE, None)
-SIG_BUSY = (SIGNAL_BUSY, None)
+SIG_TASK = (SIGNAL_TASK, None)
+
+# Bounds and start value of an adaptive queue length
+MIN_LEN = 2
+MAX_LEN = 256
+START_LEN = 8
+
+# The number of nodes per message when the master seeds the workers
+SEED_SIZE = 16
+
+
+class Statistics(object):
+
+    '''
+    Counters, timers and sampled values of a process of the search.
+    '''
+
+    def __init__(self, role):
+        '''
+        Starts the statistics of the current process.
+
+        Parameters
+        ----------
+        role : str
+            The role of the process, i.e. 'master', 'hub' or 'worker'.
+        '''
+
+        self.role = role
+        self.name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.start = time.time()
+        self.counters = {}
+        self.timers = {}
+        self.samples = {}
+
+    def count(self, key, amount = 1):
+        '''
+        Adds to a counter.
+        '''
+
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_time(self, key, seconds):
+        '''
+        Adds to a timer.
+        '''
+
+        self.timers[key] = self.timers.get(key, 0.0) + seconds
+
+    def sample(self, key, value):
+        '''
+        Records a sample of a value, such as a queue depth.
+        '''
+
+        count, total, maximum = self.samples.get(key, (0, 0, value))
+        self.samples[key] = (count + 1, total + value, max(maximum, value))
+
+    def report(self):
+        '''
+        Returns the statistics as a dictionary of plain values.
+        '''
+
+        samples = {}
+        for key, (count, total, maximum) in self.samples.iteritems():
+            samples[key] = {'count': count, 'mean': float(total) / count,
+                            'max': maximum}
+        return {'name': self.name, 'role': self.role,
+                'elapsed': time.time() - self.start,
+                'counters': dict(self.counters), 'timers': dict(self.timers),
+                'samples': samples}
+
+
+def merge_reports(reports):
+    '''
+    Sums the counters and timers of several reports.
+
+    Parameters
+    ----------
+    reports : list of dicts
+        The reports, see Statistics.report.
+
+    Returns
+    -------
+    total : dict
+        The summed counters and timers, and the number of reports.
+    '''
+
+    counters = {}
+    timers = {}
+    for report in reports:
+        for key, value in report['counters'].iteritems():
+            counters[key] = counters.get(key, 0) + value
+        for key, value in report['timers'].iteritems():
+            timers[key] = timers.get(key, 0.0) + value
+    return {'processes': len(reports), 'counters': counters,
+            'timers': timers}
+
+
+def format_report(stats):
+    '''
+    Formats the worker statistics of a search as a table, one line per
+    worker, to spot load imbalance.
+
+    Parameters
+    ----------
+    stats : dict
+        The statistics of a search, see Master.
+
+    Returns
+    -------
+    table : str
+        The formatted table.
+    '''
+
+    lines = ['%-24s %10s %10s %10s %8s %8s %8s' % ('Worker', 'Nodes',
+             'Answers', 'Pushed', 'Busy', 'Idle', 'Pickle')]
+    for report in stats['workers'] + [dict(stats['total'], name='total')]:
+        counters = report['counters']
+        timers = report['timers']
+        lines.append('%-24s %10d %10d %10d %8.1f %8.1f %8.1f' % (
+            report['name'], counters.get('nodes', 0),
+            counters.get('answers', 0), counters.get('pushed_back', 0),
+            timers.get('process', 0), timers.get('idle', 0),
+            timers.get('pickle', 0) + timers.get('unpickle', 0)))
+    return '\n'.join(lines)
+
+
+def unpack_nodes(payload):
+    '''
+    Returns the list of nodes of a SIGNAL_NODES message, which workers
+    send pickled.
+    '''
+
+    if isinstance(payload, str):
+        return cPickle.loads(payload)
+    return payload
+
+
+def auto_hubs(cpus = None, hub_size = 4):
+    '''
+    Derives a hub structure from the number of CPUs. The master and the
+    hubs mostly wait for messages, so there is a worker for every CPU. The
+    workers are spread evenly over hubs of at most hub_size workers.
+
+    Parameters
+    ----------
+    cpus : int
+        The number of CPUs. Default None, the number of CPUs of this
+        machine.
+    hub_size : int
+        The maximum number of workers of a hub. Default 4.
+
+    Returns
+    -------
+    hubs : list of ints
+        The number of workers of every hub.
+    '''
+
+    if cpus is None:
+        cpus = mp.cpu_count()
+    cpus = max(1, cpus)
+    num_hubs = -(-cpus // hub_size)
+    size, extra = divmod(cpus, num_hubs)
+    return [size + 1] * extra + [size] * (num_hubs - extra)
+
+def batches(nodes, consumers, depth):
+    '''
+    Splits a list of nodes into batches that are sent as one message each.
+    The fewer messages are waiting in the receiving queue, the more batches
+    are made, so that idle consumers get work quickly. A queue that holds a
+    message for every consumer gets a single batch.
+
+    Parameters
+    ----------
+    nodes : list
+        The nodes to send.
+    consumers : int
+        The number of processes reading from the receiving queue.
+    depth : int
+        The number of messages in the receiving queue.
+
+    Returns
+    -------
+    batches : list of lists
+        The nonempty batches of nodes.
+    '''
+
+    if not nodes:
+        return []
+    pieces = max(1, min(len(nodes), consumers - depth))
+    size = -(-len(nodes) // pieces)
+    return [nodes[i:i + size] for i in xrange(0, len(nodes), size)]
+
+class AnswerSpill(object):
+
+    '''
+    Appends answers to a file in chunks, so that a process does not have
+    to keep its answers in memory. The compact form of an answer is
+    stored, see Model.compact_answer.
+    '''
+
+    def __init__(self, model, path, chunk_size = 1024):
+        '''
+        Opens the spill file.
+
+        Parameters
+        ----------
+        model : Model object
+            The model that compacts the answers.
+        path : str
+            The file to append the answers to.
+        chunk_size : int
+            The number of answers written at once. Default 1024.
+        '''
+
+        self.model = model
+        self.file = open(path, 'ab')
+        self.chunk_size = chunk_size
+        self.chunk = []
+
+    def append(self, node):
+        '''
+        Stores an answer.
+        '''
+
+        self.chunk.append(self.model.compact_answer(node))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the pending answers to the file.
+        '''
+
+        if self.chunk:
+            cPickle.dump(self.chunk, self.file, 2)
+            self.file.flush()
+            self.chunk = []
+
+    def close(self):
+        '''
+        Writes the pending answers and closes the file.
+        '''
+
+        self.flush()
+        self.file.close()
+
+
+def spill_path(directory, prefix = 'answers'):
+    '''
+    Returns the spill file of the current process in the given directory.
+    '''
+
+    return os.path.join(directory, '%s-%d.pkl' % (prefix, os.getpid()))
+
+
+def read_chunks(path):
+    '''
+    Reads the chunks appended to a spill file.
+    '''
+
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = cPickle.load(f)
+            except EOFError:
+                break
+            yield chunk
+
+
+def read_answers(directory):
+    '''
+    Reads the answers spilled to a directory, one chunk at a time.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the spill files.
+
+    Yields
+    ------
+    The compact form of every answer.
+    '''
+
+    for path in sorted(glob.glob(os.path.join(directory, 'answers-*.pkl'))):
+        for chunk in read_chunks(path):
+            for answer in chunk:
+                yield answer
+
 
 class Worker(mp.Process):
     '''
@@ -40,7 +343,9 @@ class Worker(mp.Process):
     the system.
     '''
 
-    def __init__(self, model, queue, feed_queue, max_len = 10):
+    def __init__(self, model, queue, feed_queue, max_len = 10, consumers = 1,
+                 spill = None, pause = None, limit = None,
+                 report_interval = None):
         '''
         Initializes the worker.
 
@@ -58,6 +363,23 @@ class Worker(mp.Process):
             The maximum number of items that can be on a workers private queue,
             before items are pushed back to the hub. Acts as a means of load
             balancing. Default 10.
+        consumers : int
+            The number of workers reading from the main queue, used to size
+            the batches of pushed back nodes. Default 1.
+        spill : str
+            If given, the answers are written to a file in this directory
+            during the search instead of being sent back at the end.
+            Default None.
+        pause : mp.Event
+            While this event is set, the worker writes its open nodes to a
+            file in the spill directory instead of processing them, see
+            Master. Default None.
+        limit : mp.RawValue
+            If given, this shared value replaces max_len, so the hub can
+            tune it during the search. Default None.
+        report_interval : float
+            If given, the statistics are sent to the hub this often, in
+            seconds. They are always sent at the end. Default None.
         '''
 
         # Base class initialization
@@ -67,37 +389,136 @@ class Worker(mp.Process):
         self.main_queue = queue
         self.feed_queue = feed_queue
         self.stack = []
-        self.model = deepcopy(model)
+        self.model = model
         self.max_stack_size = max_len
+        self.limit = limit
+        self.consumers = consumers
+        self.spill = spill
+        self.pause = pause
+        self.report_interval = report_interval
+        self.credit = Fraction(0)
 
     def run(self):
         '''
         Starts the worker process.
         '''
 
-        for _, item in iter(self.main_queue.get, SIG_DONE):
-            self.stack.append(item)
-            self.feed_queue.put(SIG_BUSY)
+        self.stats = Statistics('worker')
+        next_report = None
+        if self.report_interval is not None:
+            next_report = time.time() + self.report_interval
+
+        if self.spill is not None:
+            self.answers = AnswerSpill(self.model, spill_path(self.spill))
+
+        while True:
+            try:
+                sig, item = self.main_queue.get_nowait()
+            except Empty:
+                # Out of work, hand back the credit before waiting
+                self.return_credit()
+                t = time.time()
+                sig, item = self.main_queue.get()
+                self.stats.add_time('idle', time.time() - t)
+            if sig == SIGNAL_DONE:
+                break
+
+            self.stats.count('received')
+            credit, payload = item
+            self.credit += credit
+            t = time.time()
+            self.stack.extend(unpack_nodes(payload))
+            self.stats.add_time('unpickle', time.time() - t)
 
             # Don't bother the main queue while we got items
             while len(self.stack):
+                if self.pause is not None and self.pause.is_set():
+                    self.dump()
+                    break
+
                 node = self.stack.pop()
 
                 self.process_node(node)
 
                 # Check for overflow
+                if self.limit is not None:
+                    self.max_stack_size = self.limit.value
                 if len(self.stack) > self.max_stack_size:
-                    # Put half of the things on the stack on the main queue
-                    for i in xrange(len(self.stack) / 2):
-                        self.feed_queue.put((SIGNAL_NODE, self.stack.pop()))
+                    self.push_back()
 
-            # No more items in the stack, signal the main queue
-            self.feed_queue.put(SIG_IDLE)
+                if next_report is not None and time.time() >= next_report:
+                    self.feed_queue.put((SIGNAL_STATS, self.stats.report()))
+                    next_report = time.time() + self.report_interval
 
         # This process isn't going to put anything in the queues anymore
         self.main_queue.close()
+        if self.spill is not None:
+            self.answers.close()
+            self.answers = []
+        self.feed_queue.put((SIGNAL_STATS, self.stats.report()))
         self.feed_queue.put((SIGNAL_ANSWERS, self.answers))
 
+    def return_credit(self):
+        '''
+        Returns the credit of the worker, which has no nodes left. The
+        spilled answers are flushed first, so a checkpoint taken once all
+        credit is back includes them.
+        '''
+
+        if self.credit:
+            if self.spill is not None:
+                self.answers.flush()
+            self.feed_queue.put((SIGNAL_IDLE, self.credit))
+            self.credit = Fraction(0)
+
+    def dump(self):
+        '''
+        Writes the open nodes on the stack and the pending answers to disk,
+        emptying the stack.
+        '''
+
+        nodes = []
+        while len(self.stack):
+            node = self.model.checkpoint_node(self.stack.pop())
+            if node is not None:
+                nodes.append(node)
+
+        with open(spill_path(self.spill, 'frontier'), 'ab') as f:
+            cPickle.dump(nodes, f, 2)
+        self.answers.flush()
+
+    def push_back(self):
+        '''
+        Puts half of the things on the stack on the main queue, in batches.
+        '''
+
+        t = time.time()
+        nodes = []
+        for i in xrange(len(self.stack) / 2):
+            node = self.model.export_node(self.stack.pop())
+            if node is not None:
+                nodes.append(node)
+        self.stats.add_time('export', time.time() - t)
+        if not nodes:
+            return
+
+        # Batches are pickled here instead of in the feeder thread of the
+        # queue, so the hub passes them on without unpickling
+        depth = self.main_queue.qsize()
+        self.stats.sample('queue_depth', depth)
+        parts = batches(nodes, self.consumers, depth)
+
+        # Half of the credit goes with the batches
+        credit = self.credit / (2 * len(parts))
+        for batch in parts:
+            t = time.time()
+            data = cPickle.dumps(batch, 2)
+            self.stats.add_time('pickle', time.time() - t)
+            self.stats.count('pushed_back', len(batch))
+            self.stats.count('pickled_bytes', len(data))
+            self.feed_queue.put((SIGNAL_NODES, (credit, data)))
+            self.credit -= credit
+
     def process_node(self, node):
         '''
         Processes the given node. This results in either putting new nodes on
@@ -108,12 +529,16 @@ class Worker(mp.Process):
         node : node object
             The node to be processed.
         '''
+        t = time.time()
         new_nodes = self.model.process_node(node)
+        self.stats.add_time('process', time.time() - t)
+        self.stats.count('nodes')
 
         for new_node in new_nodes:
             if new_node.terminal:
                 # Solution found!
                 self.answers.append(new_node)
+                self.stats.count('answers')
             else:
                 self.stack.append(new_node)
 
@@ -121,10 +546,16 @@ class Hub(mp.Process):
 
     '''
     The intermediate Hub class. This class has a couple of workers in its pool,
-    for which it provides jobs. If idle, the hub can perform some work as well.
+    for which it provides jobs.
+
+    The hub blocks on a single inbox, in which the workers put their
+    messages. A forwarding thread moves jobs of the master to the inbox
+    while the hub wants more work, so the hub only wakes up when there is
+    something to handle.
     '''
 
-    def __init__(self, model, queue, feed_queue, num_workers = 1, max_len = 10):
+    def __init__(self, model, queue, feed_queue, num_workers = 1, max_len = 10,
+                 spill = None, pause = None, report_interval = None):
         '''
         Create an instance of a hub.
 
@@ -142,31 +573,47 @@ class Hub(mp.Process):
             The number of workers this hub has. Default 1.
         max_len : int
             The maximum length of the job queue before jobs are pushed back to
-            the master. Default 10.
+            the master, also used for the stacks of the workers. If None, the
+            length is tuned during the search: it is halved when a worker
+            runs out of work while the job queue is empty and doubled when
+            the job queue overflows. Default 10.
+        spill : str
+            The directory the workers write their answers to, see Worker.
+            Default None.
+        pause : mp.Event
+            The event that pauses the workers, see Worker. Default None.
+        report_interval : float
+            If given, the hub and its workers send their statistics to the
+            master this often, in seconds. Default None.
         '''
 
         # Base class initialization
         super(Hub, self).__init__()
 
-        self.workers = []
         self.main_queue = queue
         self.queue = mp.Queue()
+        self.inbox = mp.Queue()
         self.feed_queue = feed_queue
-        self.model = deepcopy(model)
+        self.model = model
         self.max_len = max_len
+        self.num_workers = num_workers
+        self.report_interval = report_interval
+
+        # Queue length shared with the workers when it is tuned
+        self.limit = None
+        if max_len is None:
+            self.max_len = START_LEN
+            self.limit = mp.RawValue('i', START_LEN)
 
         self.answers = []
-        self.idle = True
         self.done = False
-        self.idle_workers = num_workers
-        self.tasks_busy = 0
-        self.tasks_accepted = 0
 
         # Create all workers and start them
         for i in range(num_workers):
-            q = mp.Queue()
-            worker = Worker(self.model, self.queue, q, max_len = max_len)
-            self.workers.append(q)
+            worker = Worker(self.model, self.queue, self.inbox,
+                            max_len = self.max_len, consumers = num_workers,
+                            spill = spill, pause = pause, limit = self.limit,
+                            report_interval = report_interval)
             worker.start()
 
     def run(self):
@@ -174,120 +621,233 @@ class Hub(mp.Process):
         Starts the hub process.
         '''
 
-        # Get a first item
-        self.get_item()
+        # Jobs of the master arrive through a forwarding thread
+        self.tasks = Queue()
+        self.wanted = threading.Event()
+        self.wanted.set()
+        forwarder = threading.Thread(target = self.forward)
+        forwarder.daemon = True
+        forwarder.start()
 
-        while not self.done:
-            # Try to get another item
-            try:
-                self.get_item(False)
-            except Empty:
-                pass
+        self.stats = Statistics('hub')
+        next_report = None
+        if self.report_interval is not None:
+            next_report = time.time() + self.report_interval
 
-            if self.idle:
-                continue
-            if self.done:
-                break
-
-            # Handle input of workers
-            self.handle_queues()
-
-            # Check for idleness
-            if not self.idle:
-                if self.tasks_busy == 0:
-                    # Signal master, that this chain is idle
-                    self.feed_queue.put((SIGNAL_IDLE, self.tasks_accepted))
-                    self.tasks_accepted = 0
-                    self.idle = True
-
-            while self.tasks_busy > len(self.workers):
-                # Check for overflow
-                if self.queue.qsize() > self.max_len:
-                    try:
-                        for i in range(self.max_len / 2):
-                            item = self.queue.get()
-                            self.tasks_busy -= 1
-                            self.feed_queue.put(item)
-                    except Empty:
-                        # Queue got empty during emptying
-                        pass
-
-                # Handle input of workers
-                self.handle_queues()
+        while not self.done:
+            t = time.time()
+            sig, item = self.inbox.get()
+            self.stats.add_time('idle', time.time() - t)
+            self.stats.count('messages')
+            self.stats.sample('queue_depth', self.queue.qsize())
+            self.handle_message(sig, item)
+
+            if next_report is not None and time.time() >= next_report:
+                self.feed_queue.put((SIGNAL_STATS, self.stats.report()))
+                next_report = time.time() + self.report_interval
+
+            # Check for overflow
+            depth = self.queue.qsize()
+            if depth > self.max_len:
+                self.push_back(self.max_len / 2)
+                self.tune(2)
+
+            # Only take jobs of the master while the workers run short
+            if depth < self.num_workers:
+                self.wanted.set()
+            else:
+                self.wanted.clear()
 
         # We're done! Signal workers we're done
-        for _ in self.workers:
+        for _ in xrange(self.num_workers):
             self.queue.put(SIG_DONE)
 
-        # Retrieve answers from workers
-        for queue in self.workers:
-            signal, answers = queue.get()
-            if signal != SIGNAL_ANSWERS:
-                raise Exception('Wrong signal: got %d expected %d' % (signal, SIGNAL_ANSWERS))
-            self.answers.extend(answers)
-
-        # Send the answers to the master
+        # Retrieve answers and statistics from workers
+        received = 0
+        while received < self.num_workers:
+            sig, item = self.inbox.get()
+            if sig == SIGNAL_ANSWERS:
+                self.answers.extend(item)
+                received += 1
+            elif sig == SIGNAL_STATS:
+                self.feed_queue.put((sig, item))
+
+        # Send the statistics and answers to the master
+        self.feed_queue.put((SIGNAL_STATS, self.stats.report()))
         self.feed_queue.put((SIGNAL_ANSWERS, self.answers))
 
-    def handle_queues(self):
+    def forward(self):
         '''
-        Retrieves one item of each worker queue and processes it.
+        Moves jobs from the main queue to the hub, while the hub wants
+        work. Runs in a separate thread of the hub process.
         '''
 
-        for queue in self.workers:
-            try:
-                sig, item = queue.get_nowait()
-                if sig == SIGNAL_NODE:
-                    self.queue.put((sig, item))
-                    self.tasks_busy += 1
-                elif sig == SIGNAL_IDLE:
-                    self.idle_workers += 1
-                    self.tasks_busy -= 1
-                elif sig == SIGNAL_BUSY:
-                    self.idle_workers -= 1
-                elif sig == SIGNAL_ANSWERS:
-                    self.answers.extend(item)
-            except Empty:
-                pass
+        while True:
+            self.wanted.wait()
+            item = self.main_queue.get()
+            self.tasks.put(item)
+            self.inbox.put(SIG_TASK)
+            if item[0] == SIGNAL_DONE:
+                break
 
-    def get_item(self, block = True):
+    def push_back(self, count):
         '''
-        Tries to retrieve an item from the main queue and processes it.
+        Moves jobs from the job queue of the workers back to the master, in
+        a single message.
 
         Parameters
         ----------
-        block : bool
-            Whether to wait for an item, or continue if no item is
-            available. Default True.
+        count : int
+            The maximum number of jobs to move.
         '''
 
+        nodes = []
+        credit = Fraction(0)
         try:
-            sig, item = self.main_queue.get(block = block)
-            if sig == SIGNAL_NODE:
-                self.queue.put((sig, item))
-                self.tasks_accepted += 1
-                self.tasks_busy += 1
-                if self.idle:
-                    self.feed_queue.put(SIG_BUSY)
-                    self.idle = False
-            elif sig == SIGNAL_DONE:
-                self.done = True
-            else:
-                raise Exception('Wrong signal: got %d' % (sig,))
+            for i in xrange(count):
+                sig, (share, payload) = self.queue.get_nowait()
+                credit += share
+                nodes.extend(unpack_nodes(payload))
         except Empty:
+            # Queue got empty during emptying
             pass
 
+        if credit:
+            self.stats.count('pushed_back', len(nodes))
+            self.feed_queue.put((SIGNAL_NODES, (credit, nodes)))
+
+    def handle_message(self, sig, item):
+        '''
+        Processes a message from the inbox.
+
+        Parameters
+        ----------
+        sig : int
+            The signal of the message.
+        item : object
+            The contents of the message.
+        '''
+
+        if sig == SIGNAL_TASK:
+            self.get_item()
+        elif sig == SIGNAL_NODES:
+            self.queue.put((sig, item))
+        elif sig == SIGNAL_IDLE:
+            # Pass the credit of the worker on to the master
+            self.feed_queue.put((sig, item))
+            if self.queue.qsize() == 0:
+                # The worker has to wait for work
+                self.tune(0.5)
+        elif sig == SIGNAL_ANSWERS:
+            self.answers.extend(item)
+        elif sig == SIGNAL_STATS:
+            self.feed_queue.put((sig, item))
+        else:
+            raise Exception('Wrong signal: got %d' % (sig,))
+
+    def tune(self, factor):
+        '''
+        Scales the queue length by the given factor, if it is tuned. Shorter
+        queues make the workers share work sooner, longer queues reduce the
+        traffic between the processes.
+        '''
+
+        if self.limit is not None:
+            self.max_len = min(MAX_LEN, max(MIN_LEN, int(self.max_len * factor)))
+            self.limit.value = self.max_len
+            self.stats.count('tuned')
+
+    def get_item(self):
+        '''
+        Processes an item of the master, that has been forwarded.
+        '''
+
+        sig, item = self.tasks.get()
+        if sig == SIGNAL_NODES:
+            self.queue.put((sig, item))
+        elif sig == SIGNAL_DONE:
+            self.done = True
+        else:
+            raise Exception('Wrong signal: got %d' % (sig,))
+
+
+class SearchManager(BaseManager):
+
+    '''
+    Manager through which hubs on other hosts reach the queues of the
+    master. The master serves the queues, hub servers connect to them.
+    '''
+
+    pass
+
+# The master registers the callables, hub servers only the names
+SearchManager.register('get_queue')
+SearchManager.register('get_inbox')
+SearchManager.register('get_setup')
+
+
+def run_hub(address, authkey, num_workers = 1):
+    '''
+    Runs a hub with local workers for a master on another host, until the
+    search is done. The model is received from the master. A hub started
+    before the master waits for it.
+
+    Parameters
+    ----------
+    address : tuple
+        The (host, port) the master listens on.
+    authkey : str
+        The key to authenticate with the master.
+    num_workers : int
+        The number of workers of the hub. Default 1.
+    '''
+
+    manager = SearchManager(address, authkey)
+    while True:
+        try:
+            manager.connect()
+            break
+        except socket.error:
+            time.sleep(1)
+    setup = manager.get_setup()._getvalue()
+    model = cPickle.loads(setup['model'])
+
+    # The workers of this host map the graph data
+    directory = tempfile.mkdtemp()
+    try:
+        model.share(directory)
+        hub = Hub(model, manager.get_queue(), manager.get_inbox(),
+                  num_workers = num_workers, max_len = setup['max_len'],
+                  report_interval = setup['report_interval'])
+        hub.run()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
 
 class Master(object):
 
     '''
     The master of the search. Starts the hubs and collects the results.
+
+    The master can checkpoint the search. It periodically pauses the
+    workers, which then write their open nodes to disk instead of
+    processing them. Once all tasks are done, the open nodes and the sizes
+    of the answer files form a consistent checkpoint, from which the search
+    continues or can be resumed later.
     '''
 
-    def __init__(self, model, hub_division, max_len = 10):
+    def __init__(self, model, hub_division, max_len = 10, spill = None,
+                 checkpoint = None, interval = 600, resume = False,
+                 address = None, authkey = None, remote_hubs = 0,
+                 report_file = None, report_interval = 60):
         '''
         Creates an instance of the master.
 
+        After the search, the answers are in the answers attribute and the
+        statistics of all processes in the report attribute: a dictionary
+        with the report of the master, lists with the reports of the hubs
+        and of the workers, and the totals of the workers.
+
         Parameters
         ----------
         model : model object
@@ -300,65 +860,577 @@ class Master(object):
             one with 2 workers and one with 3.
         max_len : int
             The maximum length for a queue of the hubs and workers,
-            before they start pushing back. Default 10.
+            before they start pushing back. If None, every hub tunes the
+            length during the search, see Hub. Default 10.
+        spill : str
+            If given, the workers write the answers to files in this
+            directory instead of collecting them, read them with
+            read_answers. Default None.
+        checkpoint : str
+            If given, the search is checkpointed in this directory, which
+            is then also used to spill the answers. Default None.
+        interval : float
+            The number of seconds between checkpoints. Default 600.
+        resume : bool
+            Whether to resume the search from the checkpoint in the
+            checkpoint directory. Otherwise the files of an earlier
+            search in the directory are removed. Default False.
+        address : tuple
+            The (host, port) to listen on for hubs on other hosts, which
+            are started with run_hub. Default None.
+        authkey : str
+            The key remote hubs authenticate with. Required with remote
+            hubs, as anyone holding it can send pickles to the master.
+            Default None.
+        remote_hubs : int
+            The number of remote hubs. The master waits for the answers of
+            all of them, they each count as one worker for the
+            distribution of the roots. Default 0.
+        report_file : str
+            If given, the latest statistics of all processes are written to
+            this file as JSON during the search, and the final report at the
+            end. Default None.
+        report_interval : float
+            The number of seconds between updates of the report file.
+            Default 60.
         '''
         self.model = model
         self.queue = mp.Queue()
-        self.hubs = []
+        self.inbox = mp.Queue()
         self.answers = []
-        self.idle_hubs = len(hub_division)
-
-        self.queue.put((SIGNAL_NODE, model.get_root()))
-        self.tasks_busy = 1
-        done = False
-
-        # Create all workers and start them
+        self.stats = Statistics('master')
+        self.reports = {}
+        self.report_file = report_file
+        self.report_interval = None
+        if report_file is not None:
+            self.report_interval = report_interval
+            self.next_report = time.time() + report_interval
+        self.num_hubs = len(hub_division) + remote_hubs
+        self.num_workers = sum(hub_division) + remote_hubs
+
+        # The credit that has not been returned by idle workers
+        self.outstanding = Fraction(0)
+
+        if remote_hubs and checkpoint is not None:
+            raise ValueError('Checkpoints are not supported with remote hubs')
+        if remote_hubs and not authkey:
+            raise ValueError('Remote hubs need a non-empty authkey')
+        manager = None
+        if remote_hubs:
+            manager = self.serve(address, authkey, max_len, self.report_interval)
+
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.pause = None
+        if checkpoint is not None:
+            spill = checkpoint
+            self.pause = mp.Event()
+            roots = self.restore(resume)
+        else:
+            roots = model.get_roots()
+
+        # Create all hubs and start them
         for i in hub_division:
-            q = mp.Queue()
-            hub = Hub(model, self.queue, q, num_workers = i, max_len = max_len)
-            self.hubs.append(q)
+            hub = Hub(model, self.queue, self.inbox, num_workers = i,
+                      max_len = max_len, spill = spill, pause = self.pause,
+                      report_interval = self.report_interval)
             hub.start()
 
-        # Main loop
-        while not done:
-            # Handle input of workers
-            self.handle_queues()
-
-            # Check for completion
-            if self.tasks_busy == 0:
-                done = True
+        # Main loop, wait for messages until all tasks are done
+        while roots:
+            self.seed(roots)
+            self.wait()
+            if self.pause is not None and self.pause.is_set():
+                roots = self.save()
+            else:
+                roots = []
 
         # We're done! Signal hubs we're done
-        for _ in self.hubs:
+        for _ in xrange(self.num_hubs):
             self.queue.put(SIG_DONE)
 
-        # Retrieve answers from hubs
-        for queue in self.hubs:
-            sig, answers = queue.get()
-            if sig != SIGNAL_ANSWERS:
-                raise Exception('Wrong signal: got %d expected %d' % (sig, SIGNAL_ANSWERS))
-            self.answers.extend(answers)
+        # Retrieve answers and statistics from hubs
+        received = 0
+        while received < self.num_hubs:
+            sig, item = self.inbox.get()
+            if sig == SIGNAL_ANSWERS:
+                self.answers.extend(item)
+                received += 1
+            elif sig == SIGNAL_STATS:
+                self.reports[item['name']] = item
+
+        if manager is not None:
+            manager.shutdown()
+
+        self.report = self.build_report()
+        if report_file is not None:
+            self.write_report()
+
+        # The answer files are complete now
+        if checkpoint is not None:
+            self.write_checkpoint([], True)
+
+    def serve(self, address, authkey, max_len, report_interval):
+        '''
+        Starts a manager process that gives remote hubs access to the
+        queues and the model.
+
+        Returns
+        -------
+        manager : SearchManager
+            The started manager.
+        '''
+
+        setup = {'model': cPickle.dumps(self.model, 2), 'max_len': max_len,
+                 'report_interval': report_interval}
+
+        class Manager(SearchManager):
+            pass
+
+        Manager.register('get_queue', callable = lambda: self.queue)
+        Manager.register('get_inbox', callable = lambda: self.inbox)
+        Manager.register('get_setup', callable = lambda: setup)
+
+        manager = Manager(address, authkey)
+        manager.start()
+        return manager
+
+    def seed(self, roots):
+        '''
+        Spreads the given nodes over all workers, handing out all credit.
+        Many nodes are sent in small batches, so that pushed back work is
+        not made of large batches either.
+        '''
+
+        pieces = max(self.num_workers, -(-len(roots) // SEED_SIZE))
+        parts = batches(roots, pieces, 0)
+        for batch in parts:
+            self.queue.put((SIGNAL_NODES, (Fraction(1, len(parts)), batch)))
+        if parts:
+            self.outstanding = Fraction(1)
+
+    def wait(self):
+        '''
+        Handles messages until all credit is returned, i.e. all workers are
+        idle and no jobs are left. When checkpointing, the workers are
+        paused once the interval has passed.
+        '''
+
+        deadline = time.time() + self.interval
+        while self.outstanding > 0:
+            timeout = None
+            if self.pause is not None and not self.pause.is_set():
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    self.pause.set()
+                    continue
+
+            try:
+                t = time.time()
+                sig, item = self.inbox.get(True, timeout)
+            except Empty:
+                continue
+            finally:
+                self.stats.add_time('idle', time.time() - t)
+            self.stats.count('messages')
+            self.stats.sample('queue_depth', self.queue.qsize())
+            self.handle_message(sig, item)
+
+    def save(self):
+        '''
+        Collects the open nodes written by the paused workers, writes a
+        checkpoint and lets the workers continue.
+
+        Returns
+        -------
+        frontier : list
+            The open nodes.
+        '''
+
+        paths = glob.glob(os.path.join(self.checkpoint, 'frontier-*.pkl'))
+        frontier = []
+        for path in paths:
+            for chunk in read_chunks(path):
+                frontier.extend(chunk)
+
+        self.write_checkpoint(frontier)
+        for path in paths:
+            os.remove(path)
+
+        self.pause.clear()
+        return frontier
+
+    def write_checkpoint(self, frontier, done = False):
+        '''
+        Writes the open nodes and the sizes of the answer files to the
+        checkpoint file, replacing the previous checkpoint at once.
+
+        Parameters
+        ----------
+        frontier : list
+            The open nodes.
+        done : bool
+            Whether the search is complete. Default False.
+        '''
+
+        sizes = {}
+        for path in glob.glob(os.path.join(self.checkpoint, 'answers-*.pkl')):
+            sizes[os.path.basename(path)] = os.path.getsize(path)
+
+        path = os.path.join(self.checkpoint, 'checkpoint.pkl')
+        with open(path + '.tmp', 'wb') as f:
+            cPickle.dump({'frontier': frontier, 'answers': sizes,
+                          'done': done}, f, 2)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+    def restore(self, resume):
+        '''
+        Prepares the checkpoint directory. Answers found after the last
+        checkpoint are discarded, as their nodes are open again.
+
+        Parameters
+        ----------
+        resume : bool
+            Whether to continue from the checkpoint. Otherwise the search
+            starts from the roots of the model.
+
+        Returns
+        -------
+        roots : list
+            The nodes to start the search from.
+        '''
+
+        path = os.path.join(self.checkpoint, 'checkpoint.pkl')
+        if resume and os.path.exists(path):
+            with open(path, 'rb') as f:
+                state = cPickle.load(f)
+        else:
+            state = {'frontier': self.model.get_roots(), 'answers': {}}
+
+        for path in glob.glob(os.path.join(self.checkpoint, 'answers-*.pkl')):
+            size = state['answers'].get(os.path.basename(path))
+            if size is None:
+                os.remove(path)
+            else:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        for path in glob.glob(os.path.join(self.checkpoint, 'frontier-*.pkl')):
+            os.remove(path)
+
+        # Start from a consistent checkpoint
+        self.write_checkpoint(state['frontier'])
+        return state['frontier']
+
+    def handle_message(self, sig, item):
+        '''
+        Processes a message of one of the hubs.
+
+        Parameters
+        ----------
+        sig : int
+            The signal of the message.
+        item : object
+            The contents of the message.
+        '''
+
+        if sig == SIGNAL_NODES:
+            credit, payload = item
+            parts = batches(unpack_nodes(payload), self.num_hubs,
+                            self.queue.qsize())
+            for batch in parts:
+                self.queue.put((sig, (credit / len(parts), batch)))
+            if not parts:
+                self.outstanding -= credit
+        elif sig == SIGNAL_IDLE:
+            self.outstanding -= item
+        elif sig == SIGNAL_STATS:
+            self.reports[item['name']] = item
+            if self.report_file is not None and time.time() >= self.next_report:
+                self.write_report()
+                self.next_report = time.time() + self.report_interval
+        else:
+            raise Exception('Wrong signal: got %d' % (sig,))
+
+    def build_report(self):
+        '''
+        Returns the latest statistics of all processes, see __init__.
+        '''
+
+        reports = sorted(self.reports.values(), key = lambda r: r['name'])
+        workers = [r for r in reports if r['role'] == 'worker']
+        return {'master': self.stats.report(),
+                'hubs': [r for r in reports if r['role'] == 'hub'],
+                'workers': workers, 'total': merge_reports(workers)}
+
+    def write_report(self):
+        '''
+        Writes the latest statistics to the report file, replacing the
+        previous report at once.
+        '''
+
+        path = self.report_file
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.build_report(), f, indent = 1, sort_keys = True)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+
+class StealingWorker(mp.Process):
+
+    '''
+    A worker of the work-stealing scheduler. The worker owns a deque of
+    nodes, it processes the deepest node itself and gives the shallowest
+    nodes to idle workers that ask for them.
+    '''
+
+    def __init__(self, model, index, inboxes, results, busy, nodes,
+                 max_steal = 8, spill = None):
+        '''
+        Initializes the worker.
+
+        Parameters
+        ----------
+        model : Model object
+            The model of the problem that is being solved.
+        index : int
+            The index of this worker.
+        inboxes : list of mp.Queue
+            The inboxes of all workers, by index.
+        results : mp.Queue
+            The queue to send the answers to when the search is done.
+        busy : mp.Value
+            The shared number of busy workers plus stolen nodes in transit.
+            The search is done when it drops to zero.
+        nodes : list
+            The initial nodes of this worker.
+        max_steal : int
+            The maximum number of nodes given away at once. Default 8.
+        spill : str
+            The directory to write the answers to, see Worker. Default None.
+        '''
+
+        # Base class initialization
+        mp.Process.__init__(self)
+
+        self.model = model
+        self.index = index
+        self.inboxes = inboxes
+        self.inbox = inboxes[index]
+        self.results = results
+        self.busy = busy
+        self.stack = deque(nodes)
+        self.max_steal = max_steal
+        self.spill = spill
+        self.answers = []
+
+    def run(self):
+        '''
+        Starts the worker process.
+        '''
+
+        if self.spill is not None:
+            self.answers = AnswerSpill(self.model, spill_path(self.spill))
+
+        # Workers without initial nodes start out idle
+        done = False if len(self.stack) else self.steal()
+        while not done:
+            # Work on our own nodes, serving thieves in between
+            while len(self.stack):
+                self.process_node(self.stack.pop())
+                self.serve()
+
+            # Out of work, leave the busy count
+            with self.busy.get_lock():
+                self.busy.value -= 1
+                finished = self.busy.value == 0
+
+            if finished:
+                for inbox in self.inboxes:
+                    inbox.put(SIG_DONE)
+
+            done = self.steal()
+
+        if self.spill is not None:
+            self.answers.close()
+            self.answers = []
+        self.results.put((SIGNAL_ANSWERS, self.answers))
 
-    def handle_queues(self):
+    def serve(self):
         '''
-        Retrieves one item of each worker queue and processes it.
+        Answers the steal requests that have arrived, without blocking.
         '''
 
-        for queue in self.hubs:
+        while True:
             try:
-                sig, item = queue.get_nowait()
-                if sig == SIGNAL_NODE:
-                    self.queue.put((sig, item))
-                    self.tasks_busy += 1
-                elif sig == SIGNAL_IDLE:
-                    self.idle_hubs += 1
-                    self.tasks_busy -= item
-                elif sig == SIGNAL_BUSY:
-                    self.idle_hubs -= 1
-                else:
-                    raise Exception('Wrong signal: got %d' % (sig,))
+                sig, thief = self.inbox.get_nowait()
             except Empty:
-                pass
+                return
+            self.give(thief)
+
+    def give(self, thief):
+        '''
+        Sends the shallowest nodes of the deque to a thief. At least one
+        node is kept, a worker without spare nodes sends an empty list.
+        '''
+
+        loot = []
+        while len(self.stack) > 1 and len(loot) < self.max_steal and \
+                len(loot) < len(self.stack):
+            node = self.model.export_node(self.stack.popleft())
+            if node is not None:
+                loot.append(node)
+
+        if loot:
+            # The loot is counted as busy until the thief takes over
+            with self.busy.get_lock():
+                self.busy.value += 1
+        self.inboxes[thief].put((SIGNAL_LOOT, loot))
+
+    def steal(self):
+        '''
+        Asks other workers for nodes until some are received or the search
+        is done. Requests of other workers are answered in the meantime.
+
+        Returns
+        -------
+        done : bool
+            Whether the search is done.
+        '''
+
+        others = [i for i in xrange(len(self.inboxes)) if i != self.index]
+        random.shuffle(others)
+        delay = 0.001
+        attempt = 0
+        if others:
+            self.inboxes[others[0]].put((SIGNAL_STEAL, self.index))
+
+        while True:
+            sig, item = self.inbox.get()
+            if sig == SIGNAL_DONE:
+                return True
+            elif sig == SIGNAL_STEAL:
+                self.give(item)
+            elif sig == SIGNAL_LOOT:
+                if item:
+                    # The busy count of the loot is ours now
+                    self.stack.extend(item)
+                    return False
+
+                # Back off after asking everyone in vain
+                attempt += 1
+                if attempt % len(others) == 0:
+                    time.sleep(delay)
+                    delay = min(2 * delay, 0.05)
+                victim = others[attempt % len(others)]
+                self.inboxes[victim].put((SIGNAL_STEAL, self.index))
+            else:
+                raise Exception('Wrong signal: got %d' % (sig,))
+
+    def process_node(self, node):
+        '''
+        Processes the given node, putting its children on the deque and
+        storing the answers.
+
+        Parameters
+        ----------
+        node : node object
+            The node to be processed.
+        '''
+
+        for new_node in self.model.process_node(node):
+            if new_node.terminal:
+                self.answers.append(new_node)
+            else:
+                self.stack.append(new_node)
+
+
+class WorkStealing(object):
+
+    '''
+    A scheduler without central queues. Every worker owns a deque of nodes
+    and idle workers steal the shallowest nodes of their peers. The search
+    ends when a shared counter of busy workers drops to zero.
+    '''
+
+    def __init__(self, model, num_workers, max_steal = 8, spill = None):
+        '''
+        Runs the search and collects the results.
+
+        Parameters
+        ----------
+        model : model object
+            The model of the problem that is solved.
+        num_workers : int
+            The number of worker processes.
+        max_steal : int
+            The maximum number of nodes taken in a single steal. Default 8.
+        spill : str
+            The directory to write the answers to, see Master. Default None.
+        '''
+
+        self.model = model
+        self.answers = []
+
+        # Deal the roots to the workers
+        initial = [[] for i in xrange(num_workers)]
+        for i, root in enumerate(model.get_roots()):
+            initial[i % num_workers].append(root)
+
+        busy = mp.Value('i', sum(1 for nodes in initial if nodes))
+        if busy.value == 0:
+            return
+
+        inboxes = [mp.Queue() for i in xrange(num_workers)]
+        results = mp.Queue()
+
+        workers = []
+        for i in xrange(num_workers):
+            worker = StealingWorker(model, i, inboxes, results, busy,
+                                    initial[i], max_steal = max_steal,
+                                    spill = spill)
+            worker.start()
+            workers.append(worker)
+
+        for i in xrange(num_workers):
+            sig, item = results.get()
+            self.answers.extend(item)
+
+        for worker in workers:
+            worker.join()
+
+
+def search(model):
+    '''
+    Performs the complete tree search in the current process, depth first.
+
+    Parameters
+    ----------
+    model : Model object
+        The model of the problem that is being solved.
+
+    Returns
+    -------
+    (answers, processed) : tuple
+        The list of terminal nodes found and the number of nodes that
+        have been processed.
+    '''
+
+    answers = []
+    stack = list(model.get_roots())
+    processed = 0
+    while len(stack):
+        node = stack.pop()
+        processed += 1
+        for new_node in model.process_node(node):
+            if new_node.terminal:
+                answers.append(new_node)
+            else:
+                stack.append(new_node)
+
+    return answers, processed
 
 
 class Model(object):
@@ -385,13 +1457,71 @@ class Model(object):
 
         raise NotImplementedError
 
-    def get_root_node(self):
+    def export_node(self, node):
+        '''
+        Prepares a node for being sent to another process. By default the
+        node is sent as is.
+
+        Parameters
+        ----------
+        node : Node object
+            The node that is sent.
+
+        Returns
+        -------
+        node : Node object
+            The node to send, or None if there is nothing left to process.
+        '''
+
+        return node
+
+    def checkpoint_node(self, node):
+        '''
+        Returns the form in which an open node is stored in a checkpoint,
+        or None if there is nothing left to process. By default the node
+        is exported, see export_node.
+        '''
+
+        return self.export_node(node)
+
+    def compact_answer(self, node):
+        '''
+        Returns the form in which an answer is stored when the answers are
+        written to disk. By default the node itself.
+        '''
+
+        return node
+
+    def share(self, directory):
+        '''
+        Moves data that never changes to files in the given directory, which
+        the processes of the search map instead of copying. By default
+        nothing is shared.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to store the files in. It has to exist until the
+            search is done.
+        '''
+
+        pass
+
+    def get_root(self):
         '''
         Returns the root node of the search tree.
         '''
 
         raise NotImplementedError
 
+    def get_roots(self):
+        '''
+        Returns the root nodes of independent parts of the search. By
+        default the search has a single root.
+        '''
+
+        return [self.get_root()]
+
 
 class Node(object):
 
@@ -410,3 +1540,19 @@ class Node(object):
         '''
 
         self.terminal = terminal
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Run a hub for a master on another host.')
+    parser.add_argument('address', help='host:port of the master')
+    parser.add_argument('workers', type=int, help='number of workers')
+    parser.add_argument('-k', '--authkey', required=True,
+        help='The key to authenticate with the master.')
+
+    args = parser.parse_args()
+
+    host, port = args.address.rsplit(':', 1)
+    run_hub((host, int(port)), args.authkey, args.workers)
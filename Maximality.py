@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+'''
+Implements an in-process filter that finds the maximal sets of a collection.
+
+The sets are stored as packed bitsets. An inverted index maps every item to
+the sorted ranks (by increasing size) of the sets containing it. A set is
+not maximal iff it is a subset of a set of larger rank, and all those sets
+contain the rarest item of the set, so only that posting list is tested.
+
+Copyright (C) 2012  Steven Laan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see http://www.gnu.org/licenses/
+'''
+
+# Python imports
+import os
+import multiprocessing as mp
+
+# 3rd party libraries
+import numpy as np
+
+# Own imports
+import Bitsets
+
+# Maximum number of unpacked bits handled at once
+CHUNK_BITS = 1 << 24
+
+
+class SetIndex(object):
+
+    '''
+    A collection of packed sets with an inverted index for subset queries.
+    '''
+
+    def __init__(self, sets, n, directory=None):
+        '''
+        Builds the index for the given sets.
+
+        Parameters
+        ----------
+        sets : iterable of np.ndarray
+            The packed bitsets over n items. May be a generator, the sets
+            are consumed once.
+        n : int
+            The number of items.
+        directory : str
+            If given, the packed sets and the inverted index are stored in
+            memory-mapped files in this directory, which bounds the memory
+            use for very large collections. Default None, keep everything
+            in memory.
+        '''
+
+        self.n = n
+        self.directory = directory
+
+        self.data = self._store_sets(sets)
+        m = len(self.data)
+
+        # Count set sizes and item frequencies in chunks
+        self.sizes = np.zeros(m, dtype=np.int32)
+        self.frequency = np.zeros(n, dtype=np.int64)
+        for start, bits in self._chunks():
+            self.sizes[start:start + len(bits)] = bits.sum(axis=1)
+            self.frequency += bits.sum(axis=0)
+
+        # Ranks by increasing size
+        self.order = np.argsort(self.sizes, kind='mergesort')
+        self.rank = np.empty(m, dtype=np.int64)
+        self.rank[self.order] = np.arange(m)
+
+        # Inverted index, posting lists are sorted ranks
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.frequency, out=self.indptr[1:])
+        dtype = np.int32 if m < 2 ** 31 else np.int64
+        self.postings = self._array('postings', self.indptr[-1], dtype)
+
+        # Items ordered from rare to frequent
+        by_frequency = np.argsort(self.frequency, kind='mergesort')
+        self.rarest = np.empty(m, dtype=np.int64)
+
+        fill = self.indptr[:-1].copy()
+        for start, bits in self._chunks():
+            rarest = by_frequency[bits[:, by_frequency].argmax(axis=1)]
+            rarest[self.sizes[start:start + len(bits)] == 0] = -1
+            self.rarest[start:start + len(bits)] = rarest
+
+            # Pairs (item, set) grouped by item
+            items, members = np.nonzero(bits.T)
+            counts = np.bincount(items, minlength=n)
+            offsets = np.arange(len(items)) - np.repeat(
+                np.cumsum(counts) - counts, counts)
+            self.postings[fill[items] + offsets] = self.rank[start + members]
+            fill += counts
+
+        for item in xrange(n):
+            self.postings[self.indptr[item]:self.indptr[item + 1]].sort()
+
+    def __getstate__(self):
+        '''
+        Returns the state for pickling. Memory-mapped arrays are reopened
+        from their files instead of being copied.
+        '''
+
+        state = self.__dict__.copy()
+        if self.directory is not None:
+            state['data'] = self.data.shape
+            state['postings'] = None
+        return state
+
+    def __setstate__(self, state):
+        '''
+        Restores a pickled index.
+        '''
+
+        self.__dict__.update(state)
+        if self.directory is not None:
+            path = os.path.join(self.directory, 'sets.bin')
+            self.data = np.memmap(path, dtype=np.uint8, mode='r',
+                                  shape=state['data'])
+            path = os.path.join(self.directory, 'postings.npy')
+            self.postings = np.load(path, mmap_mode='r')
+
+    def _array(self, name, length, dtype):
+        '''
+        Allocates an array, memory-mapped if a directory is used.
+        '''
+
+        if self.directory is None:
+            return np.empty(length, dtype=dtype)
+        path = os.path.join(self.directory, name + '.npy')
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                         shape=(length,))
+
+    def _store_sets(self, sets):
+        '''
+        Stores the packed sets in a matrix, in a file if a directory is used.
+        In memory, the sets are copied into a buffer that grows by half its
+        size when full, and is cut to size at the end.
+        '''
+
+        width = Bitsets.num_bytes(self.n)
+        if self.directory is None:
+            data = Bitsets.empty(self.n, 1024)
+            m = 0
+            for s in sets:
+                if m == len(data):
+                    data.resize((m + m // 2, width), refcheck=False)
+                data[m] = s
+                m += 1
+            data.resize((m, width), refcheck=False)
+            return data
+
+        path = os.path.join(self.directory, 'sets.bin')
+        m = 0
+        with open(path, 'wb') as f:
+            for s in sets:
+                f.write(np.asarray(s, dtype=np.uint8).tostring())
+                m += 1
+        if not m:
+            return Bitsets.empty(self.n, 0)
+        return np.memmap(path, dtype=np.uint8, mode='r', shape=(m, width))
+
+    def _chunks(self):
+        '''
+        Iterates over the sets in unpacked chunks.
+
+        Yields
+        ------
+        (start, bits) : tuple
+            The index of the first set in the chunk and the boolean matrix
+            of the sets in the chunk.
+        '''
+
+        step = max(1, CHUNK_BITS // max(1, self.n))
+        for start in xrange(0, len(self.data), step):
+            yield start, Bitsets.unpack(self.data[start:start + step], self.n)
+
+    def contained(self, i):
+        '''
+        Returns whether set i is a subset of a set of larger rank, i.e. of a
+        larger set or of an equal set that comes later in the ordering.
+        '''
+
+        rarest = self.rarest[i]
+        if rarest < 0:
+            return self.rank[i] < len(self.data) - 1
+
+        posting = self.postings[self.indptr[rarest]:self.indptr[rarest + 1]]
+        ranks = posting[np.searchsorted(posting, self.rank[i], 'right'):]
+
+        # Test the candidates in chunks, bounding the memory use
+        step = max(1, CHUNK_BITS // (8 * self.data.shape[1]))
+        for start in xrange(0, len(ranks), step):
+            supersets = self.data[np.sort(self.order[ranks[start:start + step]])]
+            if not np.all(np.any(self.data[i] & ~supersets, axis=1)):
+                return True
+
+        return False
+
+    def maximal(self, ids=None):
+        '''
+        Returns the sorted indices of the maximal sets.
+
+        Parameters
+        ----------
+        ids : iterable of ints
+            The indices of the sets to check. Default None, check all sets.
+        '''
+
+        if ids is None:
+            ids = xrange(len(self.data))
+        return np.array([i for i in ids if not self.contained(i)],
+                        dtype=np.int64)
+
+    def shards(self, count):
+        '''
+        Splits the sets into shards of roughly equal size. Sets with the
+        same rarest item end up next to each other, so a shard reads
+        only a few posting lists.
+
+        Parameters
+        ----------
+        count : int
+            The number of shards.
+
+        Returns
+        -------
+        shards : list of np.ndarray
+            The indices of the sets in each shard.
+        '''
+
+        ids = np.argsort(self.rarest, kind='mergesort')
+        return [shard for shard in np.array_split(ids, count) if len(shard)]
+
+
+# The index used by the processes of the pool
+_index = None
+
+def _init_shard_worker(index):
+    '''
+    Initializes a pool process with the set index.
+    '''
+
+    global _index
+    _index = index
+
+def _check_shard(ids):
+    '''
+    Returns the maximal sets among the given ids.
+    '''
+
+    return _index.maximal(ids)
+
+
+def maximal_sets(sets, n, directory=None, processes=1):
+    '''
+    Finds the maximal sets of a collection. Of equal sets, only the last
+    one is reported.
+
+    Parameters
+    ----------
+    sets : iterable of np.ndarray
+        The packed bitsets over n items.
+    n : int
+        The number of items.
+    directory : str
+        Directory for memory-mapped storage, see SetIndex. Default None.
+    processes : int
+        The number of processes checking shards of the sets in parallel.
+        Default 1, check all sets in this process.
+
+    Returns
+    -------
+    (data, maximal) : tuple
+        The matrix of the packed sets, in input order, and the sorted
+        indices of the maximal sets in that matrix.
+    '''
+
+    index = SetIndex(sets, n, directory)
+    if processes <= 1:
+        return index.data, index.maximal()
+
+    pool = mp.Pool(processes, _init_shard_worker, (index,))
+    results = pool.map(_check_shard, index.shards(4 * processes))
+    pool.close()
+    pool.join()
+
+    if not results:
+        return index.data, np.zeros(0, dtype=np.int64)
+    return index.data, np.sort(np.concatenate(results))
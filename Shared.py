@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+'''
+Implements read-only arrays that are shared between processes through
+memory-mapped files.
+
+Copyright (C) 2012  Steven Laan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see http://www.gnu.org/licenses/
+'''
+
+# Python imports
+import os
+
+# 3rd party libraries
+import numpy as np
+
+
+class SharedArrays(object):
+
+    '''
+    Base class for objects holding large arrays that never change.
+
+    Shared arrays are stored in memory-mapped files. When the object is
+    pickled or copied, the files are reopened instead of copying the
+    arrays, so all processes map the same pages.
+    '''
+
+    def share_arrays(self, directory, names):
+        '''
+        Moves arrays to memory-mapped files.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to store the files in. The files are named after
+            the attributes, so objects sharing a directory need attributes
+            with distinct names.
+        names : list of str
+            The names of the array attributes to share.
+        '''
+
+        shared = dict(getattr(self, 'shared', {}))
+        for name in names:
+            path = os.path.join(directory, name + '.npy')
+            np.save(path, getattr(self, name))
+            setattr(self, name, np.load(path, mmap_mode='r'))
+            shared[name] = path
+        self.shared = shared
+
+    def __getstate__(self):
+        '''
+        Returns the state for pickling, without the shared arrays.
+        '''
+
+        state = self.__dict__.copy()
+        for name in getattr(self, 'shared', {}):
+            state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        '''
+        Restores a pickled object, reopening the shared arrays.
+        '''
+
+        self.__dict__.update(state)
+        for name, path in getattr(self, 'shared', {}).iteritems():
+            setattr(self, name, np.load(path, mmap_mode='r'))
@@ -18,17 +18,14 @@ along with this program.  If not, see http://www.gnu.org/licenses/
 '''
 
 # Python imports
-import sys
 import cPickle
-from itertools import chain
-from math import log10
 import numpy as np
-import time
-import struct
 
 # 3rd party libraries
 import networkx as nx
-import BitVector as bv
+
+# Own imports
+import Bitsets
 
 TYPE_COTERIE_SEP = 'Coterie (sep)'
 TYPE_COTERIE_NONSEP = 'Coterie (nonsep)'
@@ -37,98 +34,6 @@ TYPE_HAMLET = 'Hamlet'
 CLUB_TYPES = [TYPE_COTERIE_SEP, TYPE_COTERIE_NONSEP, TYPE_SOCIAL_CIRCLE, TYPE_HAMLET]
 
 
-def make_binary(n):
-    if n < 0:
-        return 0
-    else:
-        return 1
-
-
-def write_sets_binary(sets, filename):
-    '''
-    Writes the list of bitvectors to a binary file.
-
-    Notes
-    -----
-    The used format is the following:
-    First 4 bytes for the set id,
-    Next 4 bytes for the set size,
-    Size * 4 bytes for set items.
-    '''
-    i = 0
-    f = open(filename, 'wb')
-    for S in sets:
-        n = S.count_bits_sparse()
-        f.write(struct.pack('i', i))
-        f.write(struct.pack('i', n))
-
-        i += 1
-        bit = -1
-        for j in xrange(n):
-            bit = S.next_set_bit(bit + 1)
-            f.write(struct.pack('i', bit))
-    f.close()
-
-
-def prepare_for_check(Data, verbose=False):
-    '''
-    Prepares the list of bitvectors for further analysis.
-
-    It sorts the items of each set by increasing frequency.
-    The sets are sorted by increasing size.
-
-    If verbose, the program will print the benchmarks.
-    '''
-
-    toc = time.time()
-    Data_tuples = [(S.count_bits_sparse(), S) for S in Data]
-    if verbose: print time.time() - toc, 'Counting sizes'
-
-    # Sort the list
-    toc = time.time()
-    sorted_Data = radixsort(Data_tuples)
-    if verbose: print time.time() - toc, 'Sorting by size', len(sorted_Data)
-
-    # Retrieve only the bitvectors
-    toc = time.time()
-    new_Data = [x[1] for x in sorted_Data]
-    if verbose: print time.time() - toc, 'Retrieving bitvectors', len(new_Data)
-
-    toc = time.time()
-    occurrences = [0 for x in range(len(new_Data[0]))]
-    for vec in new_Data:
-        bit = -1
-        for i in xrange(vec.count_bits_sparse()):
-            bit = vec.next_set_bit(bit + 1)
-            occurrences[bit] += 1
-    if verbose: print time.time() - toc, 'Counting bit occurences'
-
-    toc = time.time()
-    occurrences = [(occurrences[i], i) for i in range(len(occurrences))]
-    sorted_vectors = radixsort( occurrences )
-    if verbose: print time.time() - toc, 'Sorting bit occurences'
-
-    index = {}
-    rev_index = {}
-    for i in xrange(len(sorted_vectors)):
-        index[sorted_vectors[i][1]] = i
-        rev_index[i] = sorted_vectors[i][1]
-
-    toc = time.time()
-    new_vectors = []
-    for vec in new_Data:
-        new_vec = bv.BitVector(size = len(vec))
-        bit = -1
-        for i in xrange(vec.count_bits_sparse()):
-            bit = vec.next_set_bit(bit + 1)
-            new_vec[ index[bit] ] = 1
-
-        new_vectors.append(new_vec)
-    if verbose: print time.time() - toc, 'Rearranging vectors', len(new_vectors)
-
-    return new_vectors, new_Data
-
-
 def get_club_type(G):
     '''
     Finds the type of 2-club for the given graph. Assumes input graph is a
@@ -163,7 +68,7 @@ def get_club_type(G):
         return TYPE_HAMLET
 
 
-def post_process(G, sets, index_file):
+def post_process(G, sets, indices, classes=None):
     '''
     Performs some postprocessing on the results.
 
@@ -172,11 +77,16 @@ def post_process(G, sets, index_file):
     G : networkx.Graph
         The graph that has been searched in.
 
-    sets : list of bitvectors
-        List that contains all sets.
+    sets : np.ndarray
+        Matrix that contains all sets as packed bitsets.
 
-    index_file : file object
-        File that contains indices of maximal sets.
+    indices : iterable of ints
+        The indices of the maximal sets.
+
+    classes : list of lists
+        If the sets were found in the graph with its twins collapsed, the
+        indices in G.nodes() of the vertices each set member stands for,
+        see Drivers.reduce_twins. Default None.
 
     Notes
     -----
@@ -196,6 +106,7 @@ def post_process(G, sets, index_file):
         sizes[c_type] = dict()
 
     G_nodes = G.nodes()
+    n = len(G_nodes) if classes is None else len(classes)
 
     for node in G_nodes:
         search[node] = []
@@ -203,17 +114,14 @@ def post_process(G, sets, index_file):
     sets_set_form = []
 
     # Loop through all maximal indices
-    for index in index_file:
+    for index in indices:
         index = int(index)
-        current = sets[index]
 
-        # Extract the nodes from the bitvector
-        bit = -1
-        nodes = []
-        size = current.count_bits_sparse()
-        for i in xrange(size ):
-            bit = current.next_set_bit(bit + 1)
-            nodes.append(bit)
+        # Extract the nodes from the bitset
+        nodes = Bitsets.members(sets[index], n).tolist()
+        if classes is not None:
+            nodes = sorted(v for i in nodes for v in classes[i])
+        size = len(nodes)
 
         # Add to the sets
         sets_set_form.append(set(nodes))
@@ -258,21 +166,48 @@ def post_process(G, sets, index_file):
     f.close()
 
 
-def DROP(connectivity, info):
+def q_values(connectivity, live):
+    '''
+    Computes the q-values of the DROP algorithm in one vectorized pass.
+
+    Parameters
+    ----------
+    connectivity : np.ndarray
+        The connectivity for this solution, as packed bitset rows.
+    live : np.ndarray
+        The packed set of participating vertices.
+
+    Returns
+    -------
+    q : np.ndarray
+        For every participating vertex the number of participating vertices
+        it does not reach, 0 for the other vertices.
+    '''
+
+    q = Bitsets.count(live & ~connectivity).astype(np.int32)
+    q[~Bitsets.unpack(live, len(connectivity))] = 0
+    return q
+
+
+def DROP(q, degrees, info):
     '''
     Performs one step of the DROP algorithm as described by Bourjolly [1]_.
 
     Parameters
     ----------
-    connectivity : np.matrix
-        The connectivity matrix for this solution.
-    info : list of ints
+    q : np.ndarray
+        The q-values of the vertices, see q_values.
+    degrees : np.ndarray
+        The degree of each vertex in the graph induced by the
+        participating vertices.
+    info : np.ndarray
         The information for each vertex whether it is in the solution,
         out of the solution, or undecided.
 
     Returns
     -------
-    The node to remove from the solution.
+    The node to remove from the solution, or -1 if every participating
+    vertex reaches all others.
 
     References
     ----------
@@ -281,56 +216,52 @@ def DROP(connectivity, info):
            Computers & Operational Research. 27(6): 559-569, 2000.
     '''
 
-    # Participating nodes
-    nodes = [i for i, k in enumerate(info) if k >= 0]
-
-    # Calculate the q-values
-    q = dict()
-    all_zero = True
-    for i in nodes:
-        q[i] = 0
-        for j in nodes:
-            if connectivity[i, j] == 0:
-                q[i] += 1
-
-        if q[i] > 0:
-            all_zero = False
-
-    if all_zero: return -1
-
-    # Find node with maximal q of least degree
-    to_remove = None
-    for i in nodes:
-        if info[i] == 1:
-            continue
-        if to_remove == None:
-            to_remove = i
-            continue
-        if q[i] > q[to_remove]:
-            to_remove = i
-        elif q[i] == q[to_remove]:
-            if connectivity[i, i] < connectivity[to_remove, to_remove]:
-                to_remove = i
-    return to_remove
-
-
-def splitmerge(ls, digit):
-    buf = [[] for i in range(10)]
-    divisor = 10 ** digit
-    for (n,x) in ls:
-        buf[(n // divisor) % 10].append((n, x))
-    return chain(*buf)
-
-def radixsort(ls, fn=splitmerge):
+    if not q.any(): return -1
+
+    # Find undecided node with maximal q of least degree
+    undecided = np.flatnonzero(info == 0)
+    order = np.lexsort((undecided, degrees[undecided], -q[undecided]))
+    return undecided[order[0]]
+
+
+def degeneracy_ordering(neighbours):
     '''
-    Returns a sorted list in increasing order and
-    the dictionary containing the original order
+    Computes a degeneracy ordering of the vertices of a graph, by repeatedly
+    taking a vertex of minimum degree in the remaining graph.
 
     Parameters
     ----------
+    neighbours : list of arrays
+        The adjacency list of every vertex.
 
-    ls : list of tuples
-        The list to sort, it has to be a list of tuples, it will be sorted on
-        the first item of the tuple
+    Returns
+    -------
+    order : list of ints
+        The vertices in degeneracy order.
     '''
-    return list(reduce(fn, xrange(int(log10(max(abs(val) for (val, x) in ls)) + 1)), ls))
+
+    n = len(neighbours)
+    degree = [len(nbrs) for nbrs in neighbours]
+    buckets = [set() for d in xrange(max(degree + [0]) + 1)]
+    for v in xrange(n):
+        buckets[degree[v]].add(v)
+
+    removed = [False for v in xrange(n)]
+    order = []
+    d = 0
+    for i in xrange(n):
+        # Degrees drop by at most one per removal
+        d = max(d - 1, 0)
+        while not buckets[d]:
+            d += 1
+
+        v = buckets[d].pop()
+        order.append(v)
+        removed[v] = True
+        for u in neighbours[v]:
+            if not removed[u]:
+                buckets[degree[u]].remove(u)
+                degree[u] -= 1
+                buckets[degree[u]].add(u)
+
+    return order